@@ -1,5 +1,15 @@
+import functools
+import numpy as np
 import pandas as pd
 import os
+import re
+import threading
+
+from .excel_io import read_excel
+try:
+    from rapidfuzz import fuzz, process as fuzz_process  # 可选：列名模糊匹配
+except ImportError:
+    fuzz = fuzz_process = None
 
 # 路径配置
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -21,15 +31,95 @@ METRIC_CANDIDATES = {
     "SalesVolume": ["SalesVolume", "销售量", "销量", "盒数", "数量", "销售量(盒)"],
 }
 
+# 用户问题关键字 -> 逻辑列名（dict 顺序即优先级，靠前者优先）
+DIM_KEYWORDS = {
+    "省": "Province", "市": "City", "城市": "City",
+    "产品": "Product", "药": "Product", "药品": "Product",
+    "季度": "YearQuarter", "时间": "YearQuarter", "年季": "YearQuarter",
+    "渠道": "Channel", "厂家": "Manufacturer", "企业": "Manufacturer",
+    "剂型": "DosageForm", "市场": "Market",
+}
+METRIC_KEYWORDS = {"量": "SalesVolume", "盒数": "SalesVolume", "额": "SalesAmount", "金额": "SalesAmount"}
+DIM_TITLES = {v: k for k, v in DIM_KEYWORDS.items()}
+
+
+def _compile_keywords(keywords):
+    """把关键字表编译为一个正则（一次 C 层扫描找出全部命中）及其优先级表。"""
+    pattern = re.compile("|".join(re.escape(k) for k in keywords))
+    priority = {k: i for i, k in enumerate(keywords)}
+    return pattern, priority
+
+
+_DIM_RE, _DIM_PRIORITY = _compile_keywords(DIM_KEYWORDS)
+_METRIC_RE, _METRIC_PRIORITY = _compile_keywords(METRIC_KEYWORDS)
+
+
+def _match_keyword(pattern, priority, keywords, text, default):
+    """返回 text 中优先级最高的关键字对应的逻辑列名，未命中返回 default。"""
+    hits = [m.group() for m in pattern.finditer(text)]
+    if not hits:
+        return default
+    return keywords[min(hits, key=priority.__getitem__)]
+
+
+# 进程内只解析一次 Excel，多个 DataEngine 实例共享同一份 DataFrame
+_DF_CACHE = None
+_DF_CACHE_LOCK = threading.Lock()
+
+
+def _load_dataframe():
+    """读取并缓存主数据表；失败时返回空 DataFrame（不缓存，便于下次重试）。"""
+    global _DF_CACHE
+    if _DF_CACHE is not None:
+        return _DF_CACHE
+    with _DF_CACHE_LOCK:
+        if _DF_CACHE is not None:
+            return _DF_CACHE
+        print(f"正在加载数据: {DATA_PATH} ...")
+        try:
+            df = read_excel(DATA_PATH)
+            df.columns = df.columns.astype(str).str.strip()
+            print("数据加载成功！")
+        except Exception as e:
+            print(f"数据加载失败，将使用模拟数据。错误: {e}")
+            return pd.DataFrame()
+        _DF_CACHE = df
+        return _DF_CACHE
+
+
+def _invalidate_dataframe():
+    """数据文件变更后丢弃缓存，下次 _load_dataframe 重新读取。"""
+    global _DF_CACHE
+    with _DF_CACHE_LOCK:
+        _DF_CACHE = None
+
+
+def _source_mtime():
+    try:
+        return os.path.getmtime(DATA_PATH)
+    except OSError:
+        return None
+
+
+# 模糊匹配的最低得分（0-100）
+FUZZY_SCORE_CUTOFF = 80
+
 
 def _find_column(df, candidates_list):
-    """在 df 的列名中查找第一个匹配的列（支持部分包含）。"""
+    """在 df 的列名中查找第一个匹配的列（支持部分包含；均未命中时用 RapidFuzz 模糊匹配）。"""
     cols = [str(c).strip() for c in df.columns]
     for cand in candidates_list:
         c = str(cand).strip()
         for col in cols:
             if c in col or col in c:
                 return col
+    if fuzz_process is not None and cols:
+        for cand in candidates_list:
+            hit = fuzz_process.extractOne(
+                str(cand).strip(), cols, scorer=fuzz.partial_ratio, score_cutoff=FUZZY_SCORE_CUTOFF
+            )
+            if hit:
+                return hit[0]
     return None
 
 
@@ -55,16 +145,131 @@ def _fallback_metric_col(df):
     return None
 
 
+def _str_contains(series, text):
+    """字符串/category 列直接走 .str（category 只在类别上计算），其余列先转 str。"""
+    try:
+        return series.str.contains(text, na=False, regex=False)
+    except AttributeError:
+        return series.astype(str).str.contains(text, na=False, regex=False)
+
+
+def _group_sum(df, dim_col, metric_col):
+    """按维度列汇总指标列：factorize 取整数编码后 np.bincount 单遍求和，结果与 groupby.sum 一致。"""
+    metric = df[metric_col]
+    if not pd.api.types.is_numeric_dtype(metric):
+        return df.groupby(dim_col, observed=True, sort=False)[metric_col].sum()
+    # 按出现顺序编码，缺失维度值编码为 -1（与 groupby 默认 dropna 一致）
+    codes, uniques = pd.factorize(df[dim_col], sort=False)
+    vals = metric.to_numpy(dtype=np.float64, na_value=0.0)
+    valid = codes >= 0
+    if not valid.all():
+        codes, vals = codes[valid], vals[valid]
+    sums = np.bincount(codes, weights=vals, minlength=len(uniques))
+    return pd.Series(sums, index=pd.Index(uniques, name=dim_col), name=metric_col)
+
+
 class DataEngine:
     def __init__(self):
-        print(f"正在加载数据: {DATA_PATH} ...")
-        try:
-            self.df = pd.read_excel(DATA_PATH)
-            self.df.columns = self.df.columns.astype(str).str.strip()
-            print("数据加载成功！")
-        except Exception as e:
-            print(f"数据加载失败，将使用模拟数据。错误: {e}")
+        self._load()
+
+    def _load(self):
+        self._source_mtime = _source_mtime()
+        self.df = _load_dataframe()
+        if self.df.empty:
             self.df = self._generate_mock_data()
+        self._resolve_columns()
+        self._shrink_columns()
+        self._use_arrow_strings()
+        self._encode_dimensions()
+        # 相同 (维度, 指标, 过滤条件) 的聚合结果直接复用；重新加载时随实例方法一起重建
+        self._aggregate = functools.lru_cache(maxsize=256)(self._aggregate_uncached)
+
+    def _reload_if_changed(self):
+        """数据文件 mtime 变化时重新加载，并清空聚合缓存。"""
+        if _source_mtime() != self._source_mtime:
+            print("[engine] 检测到数据文件变更，重新加载。")
+            _invalidate_dataframe()
+            self._load()
+
+    def _resolve_columns(self):
+        """加载后一次性解析 逻辑列名 -> 实际列名，查询时 O(1) 取用。"""
+        df = self.df
+        if df.empty:
+            self._dim_resolved, self._metric_resolved = {}, {}
+            self._time_col = self._province_col = None
+            return
+        fallback_dim = _fallback_dimension_col(df)
+        fallback_metric = _fallback_metric_col(df)
+        self._dim_resolved = {
+            k: _find_column(df, v) or fallback_dim for k, v in DIMENSION_CANDIDATES.items()
+        }
+        self._metric_resolved = {
+            k: _find_column(df, v) or fallback_metric for k, v in METRIC_CANDIDATES.items()
+        }
+        self._time_col = _find_column(df, ["YearQuarter", "年季", "季度", "时间"])
+        self._province_col = _find_column(df, ["Province", "省份", "省"])
+
+    def _shrink_columns(self):
+        """只保留规则引擎会用到的列，并把整数列向下转型，缩小每次扫描的数据量。"""
+        if self.df.empty:
+            return
+        used = {c for c in self._dim_resolved.values() if c}
+        used.update(c for c in self._metric_resolved.values() if c)
+        used.update(c for c in (self._time_col, self._province_col) if c)
+        df = self.df[[c for c in self.df.columns if c in used]]
+        # 浮点指标列保持 float64：float32 汇总大额销售数据会有肉眼可见的误差；整数缩窄无损
+        narrowed = {c: pd.to_numeric(df[c], downcast="integer") for c in df.select_dtypes("integer").columns}
+        self.df = df.assign(**narrowed) if narrowed else df
+
+    def _use_arrow_strings(self):
+        """object 字符串列转为 string[pyarrow]：连续 Arrow 缓冲区，str.contains 走 Arrow 计算内核。
+        之后再转 category 时，类别本身也是 Arrow 字符串。"""
+        obj_cols = self.df.select_dtypes("object").columns
+        if len(obj_cols) == 0:
+            return
+        try:
+            self.df = self.df.assign(**{c: self.df[c].astype("string[pyarrow]") for c in obj_cols})
+        except (ImportError, TypeError, ValueError) as e:
+            print(f"[engine] 未启用 Arrow 字符串列: {e}")
+
+    def _encode_dimensions(self):
+        """维度/过滤列一次性转为 category，查询时 groupby 直接走整数编码路径。"""
+        if self.df.empty:
+            return
+        cols = {c for c in self._dim_resolved.values() if c}
+        cols.update(c for c in (self._time_col, self._province_col) if c)
+        encoded = {
+            c: self.df[c].astype("category")
+            for c in cols
+            if not pd.api.types.is_numeric_dtype(self.df[c])
+        }
+        if encoded:
+            # assign 生成新 DataFrame，共享缓存中的原始表保持不变
+            self.df = self.df.assign(**encoded)
+
+    def _aggregate_uncached(self, dimension_col, metric_col, year_filter, province_filter, sort_by_dim):
+        """过滤 + 分组求和 + 排序，返回 (names, values) 元组，供 lru_cache 复用。"""
+        df = self.df
+        mask = None
+        if year_filter:
+            mask = _str_contains(df[self._time_col], year_filter)
+        if province_filter:
+            m = _str_contains(df[self._province_col], province_filter)
+            mask = m if mask is None else (mask & m)
+        if mask is not None:
+            df = df[mask]
+
+        grouped = _group_sum(df, dimension_col, metric_col).reset_index()
+        if sort_by_dim:
+            grouped = grouped.sort_values(dimension_col)
+        else:
+            grouped = grouped.sort_values(metric_col, ascending=False)
+
+        # 整列一次性转换，避免 iterrows 逐行构造 Series
+        name_ser = grouped[dimension_col]
+        names = name_ser.astype(str).where(name_ser.notna(), "").to_numpy()
+        vals = pd.to_numeric(grouped[metric_col], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+        return tuple(names.tolist()), tuple(vals.tolist())
 
     def _generate_mock_data(self):
         return pd.DataFrame()
@@ -74,78 +279,44 @@ class DataEngine:
         简单规则引擎：根据用户输入解析维度/指标，并与实际 Excel 列名匹配后聚合。
         支持中英文列名。
         """
-        df = self.df.copy()
+        self._reload_if_changed()
+        # 只读共享缓存，不再整表 copy；过滤用布尔掩码一次性取子集
+        df = self.df
         if df.empty:
             return {"error": "数据为空，请检查 data/hcmdata.xlsx 是否存在且有效。"}
 
-        query_lower = query_text.lower().strip()
         query_cn = query_text.strip()
 
         # 1. 确定逻辑维度 (Dimension)
-        dimension_key = "Product"
-        dim_map = {
-            "省": "Province", "市": "City", "城市": "City",
-            "产品": "Product", "药": "Product", "药品": "Product",
-            "季度": "YearQuarter", "时间": "YearQuarter", "年季": "YearQuarter",
-            "渠道": "Channel", "厂家": "Manufacturer", "企业": "Manufacturer",
-            "剂型": "DosageForm", "市场": "Market",
-        }
-        for key, col in dim_map.items():
-            if key in query_cn or key in query_lower:
-                dimension_key = col
-                break
+        dimension_key = _match_keyword(_DIM_RE, _DIM_PRIORITY, DIM_KEYWORDS, query_cn, "Product")
 
         # 2. 确定逻辑指标 (Metric)
-        metric_key = "SalesAmount"
-        metric_map = {"量": "SalesVolume", "盒数": "SalesVolume", "额": "SalesAmount", "金额": "SalesAmount"}
-        for key, col in metric_map.items():
-            if key in query_cn or key in query_lower:
-                metric_key = col
-                break
-
-        # 3. 解析出实际数据表中的列名（含兜底：用第一列非数值/第一列数值）
-        dim_candidates = DIMENSION_CANDIDATES.get(dimension_key, [dimension_key])
-        metric_candidates = METRIC_CANDIDATES.get(metric_key, [metric_key])
-        dimension_col = _find_column(df, dim_candidates) or _fallback_dimension_col(df)
-        metric_col = _find_column(df, metric_candidates) or _fallback_metric_col(df)
+        metric_key = _match_keyword(_METRIC_RE, _METRIC_PRIORITY, METRIC_KEYWORDS, query_cn, "SalesAmount")
+
+        # 3. 取出加载时已解析好的实际列名（含兜底：用第一列非数值/第一列数值）
+        dimension_col = self._dim_resolved.get(dimension_key)
+        metric_col = self._metric_resolved.get(metric_key)
 
         if not dimension_col:
             return {"error": f"数据中找不到维度列。表头列为: {list(df.columns)}"}
         if not metric_col:
             return {"error": f"数据中找不到数值列作为指标。表头列为: {list(df.columns)}"}
 
-        # 4. 简单过滤
-        time_col = _find_column(df, ["YearQuarter", "年季", "季度", "时间"])
-        if time_col and "2024" in query_text:
-            df[time_col] = df[time_col].astype(str)
-            df = df[df[time_col].str.contains("2024", na=False)]
-        province_col = _find_column(df, ["Province", "省份", "省"])
-        if province_col and "江苏" in query_text:
-            df = df[df[province_col].astype(str).str.contains("江苏", na=False)]
+        # 4. 简单过滤条件
+        time_col = self._time_col
+        year_filter = "2024" if time_col and "2024" in query_text else None
+        province_filter = "江苏" if self._province_col and "江苏" in query_text else None
+        sort_by_dim = dimension_key == "YearQuarter" or bool(time_col and dimension_col == time_col)
 
-        # 5. 聚合
+        # 5. 聚合（命中缓存时跳过过滤与 groupby）
         try:
-            grouped = df.groupby(dimension_col)[metric_col].sum().reset_index()
+            names, vals = self._aggregate(dimension_col, metric_col, year_filter, province_filter, sort_by_dim)
         except Exception as e:
             return {"error": f"聚合失败: {e}"}
 
-        if dimension_key == "YearQuarter" or (time_col and dimension_col == time_col):
-            grouped = grouped.sort_values(dimension_col)
-        else:
-            grouped = grouped.sort_values(metric_col, ascending=False)
+        chart_data = [{"name": n, "value": v} for n, v in zip(names, vals)]
 
-        chart_data = []
-        for _, row in grouped.iterrows():
-            try:
-                val = float(row[metric_col]) if pd.notna(row[metric_col]) else 0
-            except (TypeError, ValueError):
-                val = 0
-            chart_data.append({
-                "name": str(row[dimension_col]) if pd.notna(row[dimension_col]) else "",
-                "value": val
-            })
-
-        title_dim_name = {v: k for k, v in dim_map.items()}.get(dimension_key, dimension_key)
+        title_dim_name = DIM_TITLES.get(dimension_key, dimension_key)
         title_metric_name = "销售额" if metric_key == "SalesAmount" else "销售量"
         return {
             "data": chart_data,
@@ -0,0 +1,19 @@
+"""
+Excel 读取的公共实现：规则引擎与 Gemini 引擎共用同一套引擎选择策略。
+"""
+import importlib.util
+
+import pandas as pd
+
+# 启动时探测一次 calamine 是否可用，之后每次读取不再 try/except 探测
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") is not None else None
+
+
+def read_excel(path: str, **kwargs) -> pd.DataFrame:
+    """读取 Excel：优先 calamine 引擎（快且省内存），读取失败时回退默认引擎（openpyxl）。"""
+    if EXCEL_ENGINE is not None:
+        try:
+            return pd.read_excel(path, engine=EXCEL_ENGINE, **kwargs)
+        except (ImportError, ValueError) as e:
+            print(f"[read_excel] calamine 读取失败，回退默认引擎: {e}")
+    return pd.read_excel(path, **kwargs)
@@ -2,13 +2,32 @@
 Gemini 驱动的 BI 查询引擎：意图路由、取数/分析、代码执行。
 适配自 Streamlit ChatBI 后端逻辑，无 Streamlit 依赖。
 """
+import io
 import os
 import re
+import ast
+import builtins
 import json
 import time
+import inspect
+import sqlite3
+import hashlib
+import functools
+import pickle
+import threading
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 import pandas as pd
 import numpy as np
-from typing import Optional, Dict, Any, List, Tuple
+from types import CodeType
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+import orjson
+from .excel_io import read_excel
+try:
+    import pyarrow as pa  # 可选：DataFrame -> records 走 Arrow C 层转换
+except ImportError:
+    pa = None
 try:
     from google import genai
     from google.genai import types
@@ -16,62 +35,256 @@ except ImportError:
     genai = None
     types = None
 
+# 共用的生成配置实例（默认 / JSON 输出），所有调用复用，不再逐次构造
+_DEFAULT_CFG = types.GenerateContentConfig() if types is not None else None
+JSON_CFG = types.GenerateContentConfig(response_mime_type="application/json") if types is not None else None
+
 # 路径配置
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 # 从 backend/.env 加载环境变量（含 GENAI_API_KEY），不依赖 python-dotenv
+# 整个文件一次读入后用正则提取 KEY=VALUE；已存在的环境变量（如 systemd/容器注入）不被覆盖
+# 只匹配行内空白（[ \t]），空值不会吞掉下一行；兼容 CRLF
+_ENV_LINE_RE = re.compile(r"^[ \t]*([A-Za-z_]\w*)[ \t]*=[ \t]*([^\r\n]*?)[ \t]*\r?$", re.M)
 _env_path = os.path.join(BASE_DIR, ".env")
 if os.path.exists(_env_path):
     try:
-        with open(_env_path, "r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    k, v = line.split("=", 1)
-                    os.environ[k.strip()] = v.strip().strip('"').strip("'")
+        with open(_env_path, "rb") as f:
+            _env_text = f.read().decode("utf-8", errors="ignore")
+        for k, v in _ENV_LINE_RE.findall(_env_text):
+            os.environ.setdefault(k, v.strip('"').strip("'"))
     except Exception:
         pass
 DATA_DIR = os.path.join(BASE_DIR, "data")
 FIXED_FILE_NAME = "hcmdata.xlsx"
 CLIENT_FILE_NAME = "structure.xlsx"
+EXTRA_FILES = {
+    "fact": "fact.csv",
+    "ipm": "ipmdata.xlsx",
+}
+# 加载结果快照（df/dfs_map/time_context/meta_data），源文件签名不变时进程重启直接复用
+SNAPSHOT_PATH = os.path.join(DATA_DIR, ".cache.pkl")
+SNAPSHOT_VERSION = 3
+# 单文件 Parquet 缓存的格式版本：修改读取/清洗逻辑（引擎、thousands、数值列处理等）后递增，旧缓存即失效；
+# 合并快照与 pkl 快照由它派生，签名中同样带上该版本
+PARQUET_CACHE_VERSION = 1
+
+# Gemini 响应的持久化精确缓存（SQLite），重启后仍可命中；clear_cache 时清空
+PROMPT_CACHE_PATH = os.path.join(DATA_DIR, "gemini_cache.sqlite")
+PROMPT_CACHE_TTL = 3600  # 秒
 
 # 可选：Gemini 客户端（未配置 API Key 时不使用）
 _client = None
+_client_lock = threading.Lock()  # 并发首个请求只创建一个客户端
 # 缓存主数据与元数据，避免每次请求重读文件
 # 缓存主数据与元数据，避免每次请求重读文件
 _cached_df = None
 _cached_dfs: Dict[str, pd.DataFrame] = {}  # 缓存所有已加载的 DataFrame
 _cached_time_context = None
 _cached_meta_data = None
+_cached_meta_hash = ""  # 元数据指纹，作为 LLM 响应缓存 key 的一部分
+_cached_meta_header = ""  # 元数据头部（各表行数 + 列名），供意图路由等轻量 Prompt 使用
+_cached_meta_preview: Dict[str, Any] = {}  # get_metadata_preview 的预计算结果
+_cached_available_tables_str = ""  # Prompt 中的【可用表格】片段，随 dfs_map 一起构建
+_base_exec_ctx: Dict[str, Any] = {"pd": pd, "np": np}  # 生成代码执行上下文模板，数据加载后绑定各 df_xxx
+_data_lock = threading.Lock()  # 保证并发冷启动时只有一个线程加载数据
+
+# 意图路由 / 多表计划的 LLM 响应缓存（精确匹配，LRU 淘汰）
+LLM_CACHE_SIZE = 500
+_router_cache: "OrderedDict[str, str]" = OrderedDict()
+_plan_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_llm_cache_lock = threading.Lock()
+
+# 计划执行共用的线程池：上限同时限制了所有请求对 Gemini 的并发数
+PLAN_MAX_WORKERS = 8
+_plan_executor = ThreadPoolExecutor(max_workers=PLAN_MAX_WORKERS, thread_name_prefix="plan-item")
+# 一次 Gemini 请求最多为多少个表格生成代码（共享元数据前缀，只发送一次）
+PLAN_BATCH_SIZE = 8
+
+# 意图路由的语义缓存：换个说法的同一问题按查询向量余弦相似度命中
+SEMANTIC_CACHE_SIZE = 512
+SEMANTIC_CACHE_THRESHOLD = 0.92
+# 向量计算与意图路由并行：最多等这么久看语义缓存能否命中，超时就直接调用路由，向量算完后再入缓存
+SEMANTIC_EMBED_TIMEOUT = 0.3  # 秒
+_embed_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="embed")
 
 
 # 模型配置
 FAST_MODEL = "gemini-3-flash-preview"
 DEEP_MODEL = "gemini-3-pro-preview"
 IMAGE_MODEL = "gemini-3-pro-image-preview"
+EMBED_MODEL = "gemini-embedding-001"
 
 MODEL_CHART = IMAGE_MODEL  # 6. Chart Recommendation (image_model)
 
+# 需要做数值清洗的列名关键字（主表 / 附表）
+_NUMERIC_COL_RE = re.compile("额|量|Sales|Qty|金额")
+_EXTRA_NUMERIC_COL_RE = re.compile("额|量|Sales|Qty|金额|Renminbi")
+
 
 def _get_client():
     global _client
-    if _client is not None:
-        return _client
+    client = _client
+    if client is not None:
+        return client
     api_key = os.environ.get("GENAI_API_KEY", "").strip()
     if not api_key:
         print("[gemini_engine] GENAI_API_KEY 未配置或为空，将使用规则引擎。")
         return None
+    with _client_lock:
+        # 双重检查：等锁期间其他线程可能已完成初始化
+        if _client is not None:
+            return _client
+        if genai is None:
+            print("[gemini_engine] google-genai 库未安装，请运行 pip install google-genai")
+            return None
+        try:
+            _client = genai.Client(api_key=api_key, http_options={"api_version": "v1beta"})
+            print("[gemini_engine] Gemini 客户端初始化成功。")
+            return _client
+        except Exception as e:
+            print(f"[gemini_engine] Gemini 客户端初始化失败: {e}")
+            return None
+
+
+# 引擎选择（calamine 优先，失败回退）与规则引擎共用 excel_io.read_excel；源数据带千分位逗号
+def _read_excel(path: str) -> pd.DataFrame:
+    return read_excel(path, thousands=",")
+
+
+def _parquet_cache_path(path: str) -> str:
+    """Parquet 缓存路径，文件名带缓存版本与源文件 mtime+size 签名，读取逻辑或源文件变化即自动失效。"""
+    st = os.stat(path)
+    return f"{path}.v{PARQUET_CACHE_VERSION}_{st.st_mtime_ns}_{st.st_size}.parquet"
+
+
+def _remove_stale_parquet(path: str, keep: str) -> None:
+    """清理同一源文件的旧签名 Parquet 缓存。"""
+    prefix = os.path.basename(path) + "."
+    folder = os.path.dirname(path)
+    for name in os.listdir(folder):
+        full = os.path.join(folder, name)
+        if name.startswith(prefix) and name.endswith(".parquet") and full != keep:
+            try:
+                os.remove(full)
+            except OSError:
+                pass
+
+
+def _clean_numeric_columns(df: pd.DataFrame, pattern: "re.Pattern") -> None:
+    """列名命中 pattern 的列就地转为数值：已是数值类型的列只补 0，不再往返字符串。"""
+    num_cols = [c for c in df.columns if pattern.search(str(c))]
+    for col in num_cols:
+        if pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].fillna(0)
+            continue
+        try:
+            # "string" 类型（Arrow 存储）做千分位替换，避免 astype(str) 生成逐元素 PyObject 数组
+            df[col] = pd.to_numeric(
+                df[col].astype("string").str.replace(",", "", regex=False),
+                errors="coerce",
+            ).fillna(0).to_numpy()
+        except Exception:
+            pass
+
+
+def _read_cached(path: str, num_col_re: Optional["re.Pattern"] = None) -> pd.DataFrame:
+    """
+    读取 Excel/CSV 并缓存为 Parquet。命中缓存时直接读取已清洗的数据；
+    未命中时读源文件、去除列名空白、做数值清洗，再写入新缓存并清理旧缓存。
+    """
+    cache_path = _parquet_cache_path(path)
+    if os.path.exists(cache_path):
+        try:
+            return pd.read_parquet(cache_path, engine="pyarrow")
+        except Exception as e:
+            print(f"[load_data] Parquet 缓存读取失败，回退源文件: {e}")
+
+    if path.endswith(".csv"):
+        # 解析时即去掉千分位，"1,234" 直接读成数值列，数值清洗只需补 0
+        df = pd.read_csv(path, thousands=",")
+    else:
+        df = _read_excel(path)
+    df.columns = df.columns.str.strip()
+    if num_col_re is not None:
+        _clean_numeric_columns(df, num_col_re)
+
     try:
-        from google import genai
-        _client = genai.Client(api_key=api_key, http_options={"api_version": "v1beta"})
-        print("[gemini_engine] Gemini 客户端初始化成功。")
-        return _client
-    except ImportError as e:
-        print(f"[gemini_engine] google-genai 库未安装: {e}，请运行 pip install google-genai")
-        return None
+        df.to_parquet(cache_path, engine="pyarrow", compression="zstd")
+        _remove_stale_parquet(path, keep=cache_path)
     except Exception as e:
-        print(f"[gemini_engine] Gemini 客户端初始化失败: {e}")
-        return None
+        print(f"[load_data] Parquet 缓存写入失败: {e}")
+    return df
+
+
+def _is_time_col(col: Any) -> bool:
+    col = str(col)
+    return "年季" in col or "Quarter" in col or "Date" in col or "YearQuarter" in col
+
+
+def _to_arrow_strings(df: pd.DataFrame) -> pd.DataFrame:
+    """纯文本列转为 string[pyarrow]（连续缓冲区，省内存）。
+    不用 category：groupby / value_counts 会输出全部类别，过滤后的结果会多出补零的行。"""
+    if pa is None or len(df) == 0:
+        return df
+    cols = [
+        c for c in df.select_dtypes(include=["object"]).columns
+        if pd.api.types.infer_dtype(df[c], skipna=True) == "string"
+    ]
+    if not cols:
+        return df
+    return df.astype({c: "string[pyarrow]" for c in cols})
+
+
+def _merged_snapshot_path(main_path: str, client_path: str) -> str:
+    """主表 + 架构表合并结果的 Parquet 快照路径，文件名包含两个源文件的 mtime+size 签名。"""
+    sigs = []
+    for path in (main_path, client_path):
+        st = os.stat(path)
+        sigs.append(f"{st.st_mtime_ns}_{st.st_size}")
+    return os.path.join(
+        DATA_DIR, f".merged_v{SNAPSHOT_VERSION}_p{PARQUET_CACHE_VERSION}_{'-'.join(sigs)}.parquet"
+    )
+
+
+def _load_main_merged(main_path: str, client_path: str) -> Tuple[pd.DataFrame, str]:
+    """加载主表并关联架构表，返回 (df_main, status_msg)。合并后的结果落盘为快照，下次直接读取。"""
+    merged_path = _merged_snapshot_path(main_path, client_path) if os.path.exists(client_path) else None
+    if merged_path and os.path.exists(merged_path):
+        try:
+            return pd.read_parquet(merged_path, engine="pyarrow"), "✅ 已关联架构表 (合并快照)"
+        except Exception as e:
+            print(f"[load_data] 合并快照读取失败，重新合并: {e}")
+
+    # Parquet 缓存中已是清洗后的数据，命中时跳过读取与清洗
+    df_main = _read_cached(main_path, _NUMERIC_COL_RE)
+    status_msg = ""
+    merged = False
+    if merged_path:
+        try:
+            df_client = _read_cached(client_path)
+            common_cols = list(set(df_main.columns) & set(df_client.columns))
+            if common_cols:
+                join_key = common_cols[0]
+                if df_client[join_key].duplicated().any():
+                    df_client = df_client.drop_duplicates(subset=[join_key])
+                df_main = pd.merge(df_main, df_client, on=join_key, how="left")
+                status_msg = f"✅ 已关联架构表 (Key: {join_key})"
+                merged = True
+        except Exception as e:
+            status_msg = f"⚠️ 架构表读取失败: {str(e)}"
+
+    df_main = _to_arrow_strings(df_main)
+    if merged:
+        try:
+            df_main.to_parquet(merged_path, engine="pyarrow", compression="zstd")
+            for name in os.listdir(DATA_DIR):
+                full = os.path.join(DATA_DIR, name)
+                if name.startswith(".merged_") and name.endswith(".parquet") and full != merged_path:
+                    os.remove(full)
+        except Exception as e:
+            print(f"[load_data] 合并快照写入失败: {e}")
+    return df_main, status_msg
 
 
 def load_data() -> Tuple[Optional[pd.DataFrame], Dict[str, pd.DataFrame], str]:
@@ -84,74 +297,18 @@ def load_data() -> Tuple[Optional[pd.DataFrame], Dict[str, pd.DataFrame], str]:
         return None, {}, f"❌ 找不到主数据文件: {FIXED_FILE_NAME}"
 
     try:
-        # Load Main DF
-        if FIXED_FILE_NAME.endswith(".csv"):
-            df_main = pd.read_csv(main_path)
-        else:
-            df_main = pd.read_excel(main_path)
-        df_main.columns = df_main.columns.str.strip()
-        
-        # Numeric cleanup for Main DF
-        for col in df_main.columns:
-            if any(k in str(col) for k in ["额", "量", "Sales", "Qty", "金额"]):
-                try:
-                    df_main[col] = (
-                        pd.to_numeric(
-                            df_main[col].astype(str).str.replace(",", "", regex=False),
-                            errors="coerce",
-                        ).fillna(0)
-                    )
-                except Exception:
-                    pass
-        
-        # Load Structure (Client) and Merge
+        # Load Main DF + Structure (Client) and Merge（命中合并快照时跳过读取、清洗与 merge）
         client_path = os.path.join(DATA_DIR, CLIENT_FILE_NAME)
-        status_msg = ""
-        if os.path.exists(client_path):
-            try:
-                if CLIENT_FILE_NAME.endswith(".csv"):
-                    df_client = pd.read_csv(client_path)
-                else:
-                    df_client = pd.read_excel(client_path)
-                df_client.columns = df_client.columns.str.strip()
-                common_cols = list(set(df_main.columns) & set(df_client.columns))
-                if common_cols:
-                    join_key = common_cols[0]
-                    if df_client[join_key].duplicated().any():
-                        df_client = df_client.drop_duplicates(subset=[join_key])
-                    df_main = pd.merge(df_main, df_client, on=join_key, how="left")
-                    status_msg = f"✅ 已关联架构表 (Key: {join_key})"
-            except Exception as e:
-                status_msg = f"⚠️ 架构表读取失败: {str(e)}"
-        
+        df_main, status_msg = _load_main_merged(main_path, client_path)
         dfs_map["hcm"] = df_main
 
         # 2. 加载其他数据表 (Fact, IPM, etc.)
-        extra_files = {
-            "fact": "fact.csv",
-            "ipm": "ipmdata.xlsx"
-        }
-        
-        for key, fname in extra_files.items():
+        for key, fname in EXTRA_FILES.items():
             fpath = os.path.join(DATA_DIR, fname)
             if os.path.exists(fpath):
                 try:
-                    if fname.endswith(".csv"):
-                        df_tmp = pd.read_csv(fpath)
-                    else:
-                        df_tmp = pd.read_excel(fpath)
-                    df_tmp.columns = df_tmp.columns.str.strip()
-                    # Numeric cleanup
-                    for col in df_tmp.columns:
-                        if any(k in str(col) for k in ["额", "量", "Sales", "Qty", "金额", "Renminbi"]):
-                             try:
-                                df_tmp[col] = pd.to_numeric(
-                                    df_tmp[col].astype(str).str.replace(",", "", regex=False), 
-                                    errors="coerce"
-                                ).fillna(0)
-                             except:
-                                pass
-                    dfs_map[key] = df_tmp
+                    df_tmp = _read_cached(fpath, _EXTRA_NUMERIC_COL_RE)
+                    dfs_map[key] = _to_arrow_strings(df_tmp)
                 except Exception as e:
                     print(f"[load_data] Failed to load {fname}: {e}")
 
@@ -160,19 +317,27 @@ def load_data() -> Tuple[Optional[pd.DataFrame], Dict[str, pd.DataFrame], str]:
         return None, {}, f"文件读取错误: {e}"
 
 
+_YEAR_RE = re.compile(r"(\d{4})")
+
+
 def analyze_time_structure(df: pd.DataFrame) -> Dict[str, Any]:
     """分析时间列结构，返回 MAT/YTD 等上下文。"""
     time_col = None
-    for col in df.columns:
-        if "年季" in col or "Quarter" in col or "Date" in col or "YearQuarter" in col:
-            sample = str(df[col].iloc[0]) if len(df) > 0 else ""
+    if len(df) > 0:
+        for col in [c for c in df.columns if _is_time_col(c)]:
+            sample = str(df[col].iloc[0])
             if "Q" in sample and len(sample) <= 8:
                 time_col = col
                 break
     if time_col is None:
         return {"error": "未找到标准年季列"}
 
-    sorted_periods = sorted(df[time_col].dropna().unique().astype(str))
+    return {"col_name": time_col, **_analyze_time_column(df[time_col])}
+
+
+def _analyze_time_column(time_ser: pd.Series) -> Dict[str, Any]:
+    # pd.unique 为 C 层哈希去重（不排序），再对少量唯一值排序一次
+    sorted_periods = np.sort(np.asarray(pd.unique(time_ser.dropna()), dtype=str)).tolist()
     max_q = sorted_periods[-1] if sorted_periods else ""
     min_q = sorted_periods[0] if sorted_periods else ""
     mat_list = sorted_periods[-4:] if len(sorted_periods) >= 4 else sorted_periods
@@ -183,18 +348,15 @@ def analyze_time_structure(df: pd.DataFrame) -> Dict[str, Any]:
         mat_list_prior = sorted_periods[:-4]
     is_mat_complete = len(mat_list_prior) >= 4
     ytd_list, ytd_list_prior = [], []
-    year_match = re.search(r"(\d{4})", str(max_q))
+    year_match = _YEAR_RE.search(max_q)
     if year_match:
+        # sorted_periods 已是 str，无需逐个 str()；先验期用 set 判定，避免 O(N·M) 列表成员检查
         curr_year = year_match.group(1)
-        try:
-            prev_year = str(int(curr_year) - 1)
-            ytd_list = [p for p in sorted_periods if curr_year in str(p)]
-            expected_priors = [str(p).replace(curr_year, prev_year) for p in ytd_list]
-            ytd_list_prior = [p for p in sorted_periods if p in expected_priors]
-        except Exception:
-            pass
+        prev_year = str(int(curr_year) - 1)
+        ytd_list = [p for p in sorted_periods if curr_year in p]
+        expected_priors = {p.replace(curr_year, prev_year) for p in ytd_list}
+        ytd_list_prior = [p for p in sorted_periods if p in expected_priors]
     return {
-        "col_name": time_col,
         "all_periods": sorted_periods,
         "max_q": max_q,
         "min_q": min_q,
@@ -222,28 +384,40 @@ def build_metadata(df: pd.DataFrame, time_context: Dict[str, Any]) -> str:
     info.append("")
     info.append("【各列详情】:")
     
+    # 唯一值数与数值列 min/max 在循环外整表一次算出；按 dtype 分组聚合，避免混合类型上浮为 float
+    nuniques = df.nunique(dropna=True)
+    dtypes = df.dtypes
+    numeric_by_dtype: Dict[str, List[Any]] = {}
+    for c, d in dtypes.items():
+        if pd.api.types.is_numeric_dtype(d):
+            numeric_by_dtype.setdefault(str(d), []).append(c)
+    mins: Dict[Any, Any] = {}
+    maxs: Dict[Any, Any] = {}
+    for cols in numeric_by_dtype.values():
+        sub = df[cols]
+        mins.update(sub.min().items())
+        maxs.update(sub.max().items())
+
     for col in df.columns:
-        dtype = str(df[col].dtype)
-        uniques = df[col].dropna().unique()
-        unique_count = len(uniques)
-        
-        # 判断是否为数值列
-        is_numeric = pd.api.types.is_numeric_dtype(df[col])
-        
-        if is_numeric:
+        dtype = str(dtypes[col])
+        unique_count = nuniques[col]
+
+        if col in mins:
             # 数值列：显示统计信息
-            min_val = df[col].min()
-            max_val = df[col].max()
-            desc = f"- `{col}` ({dtype}) | 唯一值数: {unique_count} | 范围: [{min_val}, {max_val}]"
+            desc = f"- `{col}` ({dtype}) | 唯一值数: {unique_count} | 范围: [{mins[col]}, {maxs[col]}]"
         else:
-            # 非数值列：传递唯一值
+            # 非数值列：传递唯一值（按首次出现顺序）；唯一值少时直接 unique，否则只取前 100 个
+            col_ser = df[col].dropna()
+            if pa is not None and dtypes[col] == object:
+                # object 列转 Arrow 字符串：去重/取样在连续缓冲区上进行，tolist 时才生成 Python str
+                col_ser = col_ser.astype("string[pyarrow]")
             if unique_count < 100:
                 # 少于100个，全量传递
-                vals = list(uniques)
+                vals = col_ser.unique().tolist()
                 desc = f"- `{col}` ({dtype}) | 唯一值数: {unique_count} | 全部值: {vals}"
             else:
                 # 100个及以上，取前100个
-                vals = list(uniques[:100])
+                vals = col_ser.drop_duplicates().head(100).tolist()
                 desc = f"- `{col}` ({dtype}) | 唯一值数: {unique_count} | 前100个值: {vals}"
         
         info.append(desc)
@@ -251,15 +425,49 @@ def build_metadata(df: pd.DataFrame, time_context: Dict[str, Any]) -> str:
     return "\n".join(info)
 
 
+def _source_signature(path: str) -> Optional[Tuple[float, int]]:
+    """源文件签名 (mtime, size)，文件不存在时返回 None。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+# build_metadata 结果缓存：源文件与表结构不变时复用，clear_cache 后重新加载也无需重建
+_metadata_cache: Dict[tuple, str] = {}
+
+
+def _build_metadata_cached(df: pd.DataFrame, time_context: Dict[str, Any]) -> str:
+    key = (
+        _source_signature(os.path.join(DATA_DIR, FIXED_FILE_NAME)),
+        _source_signature(os.path.join(DATA_DIR, CLIENT_FILE_NAME)),
+        len(df),
+        tuple(df.columns),
+    )
+    cached = _metadata_cache.get(key)
+    if cached is None:
+        cached = build_metadata(df, time_context)
+        _metadata_cache.clear()
+        _metadata_cache[key] = cached
+    return cached
+
+
 def get_history_context(messages: List[Dict], turn_limit: int = 3) -> str:
     """从消息列表生成历史上下文字符串。messages 格式 [{role, type, content}]。"""
     if not messages or len(messages) <= 1:
         return "无历史对话。"
-    recent = [m for m in messages[:-1] if m.get("type") in ("text", "report_block")]
-    slice_start = max(0, len(recent) - turn_limit * 2)
-    target = recent[slice_start:]
+    # 从倒数第二条往前只取最近 turn_limit 轮，不再对整段历史做过滤+切片
+    limit = turn_limit * 2
+    target = []
+    if limit > 0:
+        for m in reversed(messages[:-1]):
+            if m.get("type") in ("text", "report_block"):
+                target.append(m)
+                if len(target) >= limit:
+                    break
     parts = []
-    for msg in target:
+    for msg in reversed(target):
         role = "User" if msg.get("role") == "user" else "AI"
         content_str = ""
         if msg.get("type") == "text":
@@ -276,28 +484,46 @@ def get_history_context(messages: List[Dict], turn_limit: int = 3) -> str:
     return "\n".join(parts)
 
 
+_JSON_DECODER = json.JSONDecoder()
+
+
 def parse_response(text: str) -> Tuple[str, Optional[Dict]]:
     """从模型回复中解析 JSON，返回 (reasoning, json_data)。"""
+    if isinstance(text, dict):  # 调用方已解析过（如缓存命中）
+        return "", text
     reasoning = text
     json_data = None
+    # 快速路径：声明了 application/json 的回复整体就是 JSON，无需再查找括号
     try:
-        start_idx = text.find("{")
+        parsed = orjson.loads(text)
+        if isinstance(parsed, dict):
+            return "", parsed
+    except (orjson.JSONDecodeError, TypeError):
+        pass
+    start_idx = text.find("{")
+    if start_idx != -1:
+        # 常见的 ```json ... ``` 包裹：取首个 "{" 到最后一个 "}" 交给 orjson
         end_idx = text.rfind("}")
-        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            potential = text[start_idx : end_idx + 1]
+        if end_idx > start_idx:
             try:
-                json_data = json.loads(potential)
-                reasoning = text[:start_idx].strip()
-            except json.JSONDecodeError:
+                parsed = orjson.loads(text[start_idx:end_idx + 1])
+                if isinstance(parsed, dict):
+                    return text[:start_idx].strip(), parsed
+            except orjson.JSONDecodeError:
                 pass
-    except Exception:
-        pass
+        # 对象之后还有别的 "{...}"：从第一个 "{" 原地解码一个完整对象，不依赖末尾 "}" 的位置
+        try:
+            json_data, _ = _JSON_DECODER.raw_decode(text, start_idx)
+            reasoning = text[:start_idx].strip()
+        except json.JSONDecodeError:
+            pass
     return reasoning, json_data
 
 
 def normalize_result(res: Any) -> pd.DataFrame:
     """将执行结果统一转为 DataFrame。"""
-    if isinstance(res, pd.DataFrame):
+    # 绝大多数结果就是 DataFrame：精确类型判断先行，跳过 isinstance 的 MRO 遍历
+    if type(res) is pd.DataFrame or isinstance(res, pd.DataFrame):
         return res
     if isinstance(res, pd.Series):
         return res.to_frame()
@@ -306,10 +532,15 @@ def normalize_result(res: Any) -> pd.DataFrame:
             return pd.DataFrame(list(res.items()), columns=["指标", "数值"])
         except Exception:
             pass
-    try:
-        return pd.DataFrame([res])
-    except Exception:
-        return pd.DataFrame({"Result": [str(res)]})
+    if isinstance(res, (list, tuple, np.ndarray)):
+        try:
+            return pd.DataFrame(res)
+        except Exception:
+            pass
+    # 标量保留原值（数值仍可作图），其他对象转字符串
+    if isinstance(res, (str, int, float, np.generic)):
+        return pd.DataFrame({"Result": [res]})
+    return pd.DataFrame({"Result": [str(res)]})
 
 
 def _df_to_chart_data(df: pd.DataFrame) -> List[Dict[str, Any]]:
@@ -321,8 +552,9 @@ def _df_to_chart_data(df: pd.DataFrame) -> List[Dict[str, Any]]:
     name_col = None
     value_col = None
     
-    for c in df.columns:
-        if pd.api.types.is_numeric_dtype(df[c]):
+    # 直接遍历 dtypes，不为每列构造 Series
+    for c, dtype in df.dtypes.items():
+        if pd.api.types.is_numeric_dtype(dtype):
             if value_col is None:
                 value_col = c
         else:
@@ -336,27 +568,188 @@ def _df_to_chart_data(df: pd.DataFrame) -> List[Dict[str, Any]]:
     if value_col is None:
         value_col = df.columns[1] if len(df.columns) > 1 else df.columns[0]
     
-    out = []
-    for _, row in df.iterrows():
-        try:
-            val = float(row[value_col]) if pd.notna(row[value_col]) else 0
-        except (TypeError, ValueError):
-            val = 0
-        out.append({"name": str(row[name_col]) if pd.notna(row[name_col]) else "", "value": val})
-    return out
+    # 整列转换：nullable string 一次完成转字符串与缺失值填充；tolist() 在 C 层产出原生 str/float
+    names = df[name_col].astype("string").fillna("").tolist()
+    vals = pd.to_numeric(df[value_col], errors="coerce").fillna(0).to_numpy(dtype=np.float64).tolist()
+    return [{"name": n, "value": v} for n, v in zip(names, vals)]
 
 
 def _df_to_full_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
     """将 DataFrame 转为完整的 records 列表，保留所有列。"""
     if df is None or df.empty:
         return []
-    return df.replace({np.nan: None}).to_dict(orient="records")
+    # Arrow 在 C 层完成转换，NaN 直接变为 None，省去 replace 整表拷贝
+    if pa is not None and df.columns.is_unique:
+        try:
+            return pa.Table.from_pandas(df, preserve_index=False).to_pylist()
+        except (pa.ArrowException, TypeError, ValueError):
+            pass
+    # 回退：to_numpy 时直接把缺失值映射为 None，不走 replace 整表拷贝
+    cols = list(df.columns)
+    return [dict(zip(cols, row)) for row in df.to_numpy(dtype=object, na_value=None).tolist()]
+
+
+# 生成代码的静态校验：禁止导入/引用的模块与内置函数，禁止双下划线属性与文件读写类属性。
+# 这只能拦住常见的误用与已知的逃逸写法，不是安全边界——pd/np 本身能做的事无法靠 AST 检查全部封死
+_BLOCKED_MODULES = {
+    "os", "sys", "subprocess", "shutil", "socket", "importlib", "builtins",
+    "ctypes", "pickle", "multiprocessing", "threading", "pathlib", "io",
+}
+_BLOCKED_NAMES = {
+    "exec", "eval", "compile", "open", "__import__", "globals", "locals",
+    "vars", "input", "breakpoint", "exit", "quit",
+    # 字符串形式的属性访问能绕过 AST 上的属性名检查
+    "getattr", "setattr", "delattr",
+} | _BLOCKED_MODULES
+# pd/np/DataFrame 上能读写任意文件、反序列化、执行表达式或泄漏模块全局的属性：
+# read_pickle 等 read_* 读取器（见 _is_blocked_attr）、各 to_* 写出器、np 的 load/save 系列；
+# format/format_map 的字段查找（'{0.__globals__}'.format(f)）不经过 AST 属性节点；
+# query/eval 的表达式引擎会自行解析属性与 @ 局部变量；frame/traceback 属性可回溯到调用方的全局变量
+_BLOCKED_ATTRS = {
+    "to_pickle", "to_csv", "to_excel", "to_json", "to_parquet", "to_feather", "to_hdf", "to_sql",
+    "to_stata", "to_html", "to_latex", "to_markdown", "to_orc", "to_xml", "to_clipboard", "to_string",
+    "ExcelWriter", "ExcelFile", "HDFStore",
+    "load", "loads", "save", "savez", "savez_compressed", "savetxt", "loadtxt", "genfromtxt",
+    "fromfile", "tofile", "fromregex", "memmap", "DataSource", "dump", "dumps", "savefig",
+    "lib", "ctypeslib", "f2py", "testing",
+    "format", "format_map", "query", "eval", "set_option", "reset_option",
+    "gi_frame", "gi_code", "cr_frame", "ag_frame", "tb_frame", "tb_next",
+    "f_globals", "f_locals", "f_back", "f_builtins", "f_code",
+} | _BLOCKED_NAMES
+
+
+def _is_blocked_attr(name: str) -> bool:
+    return name.startswith(("__", "read_")) or name in _BLOCKED_ATTRS
+
+# 已校验并编译的代码对象（key 为源码 blake2b 摘要，先进先出，最多 256 个）
+CODE_CACHE_SIZE = 256
+_compiled_code_cache: Dict[str, CodeType] = {}
+_compiled_code_lock = threading.Lock()
+
+# 生成代码允许 import 的模块（顶层包名）
+_ALLOWED_IMPORTS = {
+    "pandas", "numpy", "math", "statistics", "datetime", "re", "collections",
+    "itertools", "functools", "decimal", "json",
+}
+
+
+def _is_blocked_module(name: str) -> bool:
+    """点分模块路径中任一段是危险模块即视为危险（如 pandas.io.common.os）。"""
+    return any(part in _BLOCKED_MODULES for part in name.split("."))
+
+
+def _restricted_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level != 0 or name.split(".")[0] not in _ALLOWED_IMPORTS or _is_blocked_module(name):
+        raise ImportError(f"生成代码不允许导入模块: {name}")
+    # from pandas.io.common import os：包本身允许，导入项仍可能是危险模块
+    for item in fromlist or ():
+        if item == "*" or _is_blocked_attr(item):
+            raise ImportError(f"生成代码不允许导入: {name}.{item}")
+    return __import__(name, globals, locals, fromlist, level)
+
+
+# 去掉危险内置函数只防误用：上下文中的 pd/np 仍能做它们本身能做的事，真正的拦截靠 _GeneratedCodeValidator
+_SAFE_BUILTINS: Dict[str, Any] = {k: v for k, v in vars(builtins).items() if k not in _BLOCKED_NAMES}
+_SAFE_BUILTINS["__import__"] = _restricted_import
+
+
+class _GeneratedCodeValidator(ast.NodeVisitor):
+    """
+    遍历 AST，拒绝危险导入、危险名字、危险属性（双下划线、文件读写等）以及经属性链拿到危险模块（如 pd.io.common.os）。
+    df.apply("to_csv", ...) 之类按字符串名调用方法的写法同样拦截：与危险属性同名的字符串常量一律拒绝。
+    """
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            if _is_blocked_module(alias.name):
+                raise ValueError(f"生成代码不允许导入模块: {alias.name}")
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        if node.module and _is_blocked_module(node.module):
+            raise ValueError(f"生成代码不允许导入模块: {node.module}")
+        # 只查模块路径不够：from pandas.io.common import os as o 的危险模块出现在导入项里
+        for alias in node.names:
+            if alias.name == "*" or _is_blocked_attr(alias.name):
+                raise ValueError(f"生成代码不允许导入: {node.module}.{alias.name}")
+        self.generic_visit(node)
+
+    def visit_Name(self, node: ast.Name) -> None:
+        if node.id in _BLOCKED_NAMES:
+            raise ValueError(f"生成代码不允许使用: {node.id}")
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        if _is_blocked_attr(node.attr):
+            raise ValueError(f"生成代码不允许访问属性: {node.attr}")
+        self.generic_visit(node)
+
+    def visit_Constant(self, node: ast.Constant) -> None:
+        if isinstance(node.value, str) and node.value.isidentifier() and _is_blocked_attr(node.value):
+            raise ValueError(f"生成代码不允许使用: {node.value!r}")
+
+
+def _compile_generated_code(code: str) -> CodeType:
+    """校验并编译 Gemini 生成的代码，结果按源码摘要缓存。校验失败抛出 ValueError。"""
+    key = hashlib.blake2b(code.encode("utf-8"), digest_size=16).hexdigest()
+    code_obj = _compiled_code_cache.get(key)
+    if code_obj is None:
+        tree = ast.parse(code, filename="<gemini>", mode="exec")
+        _GeneratedCodeValidator().visit(tree)
+        code_obj = compile(tree, "<gemini>", "exec")
+        with _compiled_code_lock:
+            _compiled_code_cache[key] = code_obj
+            while len(_compiled_code_cache) > CODE_CACHE_SIZE:
+                del _compiled_code_cache[next(iter(_compiled_code_cache))]
+    return code_obj
+
+
+# pandas 3 起写时复制始终开启，浅拷贝即可隔离原地修改；更早的版本只能深拷贝（不改全局选项，以免影响规则引擎等其他代码）
+_EXEC_DEEP_COPY = int(pd.__version__.split(".")[0]) < 3
+
+
+def _isolated_frame(df: pd.DataFrame) -> pd.DataFrame:
+    return df.copy(deep=_EXEC_DEEP_COPY)
+
+
+def _new_exec_ctx(df: pd.DataFrame, time_context: Dict[str, Any]) -> Dict[str, Any]:
+    """基于预建的 _base_exec_ctx（pd/np/各 df_xxx）生成单次执行的上下文。
+    各 DataFrame 与时间列表都复制一份：并行执行的生成代码原地修改时不会污染进程级缓存。"""
+    mat_list = list(time_context.get("mat_list", []))
+    mat_list_prior = list(time_context.get("mat_list_prior", []))
+    # 同一对象（如 df 与 df_hcm）只复制一次，避免主表被深拷贝两遍
+    copies: Dict[int, pd.DataFrame] = {}
+
+    def isolate(v):
+        if not isinstance(v, pd.DataFrame):
+            return v
+        if id(v) not in copies:
+            copies[id(v)] = _isolated_frame(v)
+        return copies[id(v)]
+
+    return {
+        **{k: isolate(v) for k, v in _base_exec_ctx.items()},
+        "df": isolate(df),
+        "results": {},
+        "result": None,
+        "current_mat": mat_list,
+        "mat_list": mat_list,
+        "prior_mat": mat_list_prior,
+        "mat_list_prior": mat_list_prior,
+        "ytd_list": list(time_context.get("ytd_list", [])),
+        "ytd_list_prior": list(time_context.get("ytd_list_prior", [])),
+    }
+
+
+def _exec_generated_code(code: str, exec_ctx: Dict[str, Any]) -> None:
+    """校验后在受限内置函数下执行生成代码（非隔离沙箱）；exec_ctx 同时作为 globals，保证 lambda/推导式能访问 df 等变量。"""
+    exec_ctx["__builtins__"] = _SAFE_BUILTINS
+    exec(_compile_generated_code(code), exec_ctx)
 
 
 def _safe_generate_content(client, model_name: str, contents: str, config: Optional[Dict] = None, retries: int = 3) -> Any:
     """带重试的 generate_content。"""
-    from google.genai import types
-    cfg = config or types.GenerateContentConfig()
+    cfg = config or _DEFAULT_CFG
     for i in range(retries):
         try:
             return client.models.generate_content(
@@ -374,20 +767,268 @@ def _safe_generate_content(client, model_name: str, contents: str, config: Optio
     return None
 
 
-def get_cached_data() -> Tuple[Optional[pd.DataFrame], Optional[Dict[str, pd.DataFrame]], Optional[Dict], Optional[str]]:
-    """获取或构建缓存的 df, dfs_map, time_context, meta_data。"""
-    global _cached_df, _cached_dfs, _cached_time_context, _cached_meta_data
-    if _cached_df is not None:
-        return _cached_df, _cached_dfs, _cached_time_context, _cached_meta_data
-    
-    df, dfs_map, _ = load_data()
-    if df is None:
-        return None, {}, None, None
-        
-    _cached_df = df
-    _cached_dfs = dfs_map
-    _cached_time_context = analyze_time_structure(df)
-    
+def _llm_cache_key(*parts: Any) -> str:
+    """由问题文本、历史与元数据指纹生成缓存 key。"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _normalize_query(query_text: str) -> str:
+    return " ".join(query_text.strip().lower().split())
+
+
+def _lru_get(cache: OrderedDict, key: str) -> Any:
+    with _llm_cache_lock:
+        if key not in cache:
+            return None
+        cache.move_to_end(key)
+        return cache[key]
+
+
+def _lru_put(cache: OrderedDict, key: str, value: Any) -> None:
+    with _llm_cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > LLM_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+class _PromptCacheStore:
+    """SQLite 存储的响应缓存：value 为 orjson 序列化结果，过期条目读取时忽略、打开时清理。"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self._path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS prompt_cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("DELETE FROM prompt_cache WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Any:
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT value, expires_at FROM prompt_cache WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"[gemini_engine] 响应缓存读取失败: {e}")
+            return None
+        if row is None or row[1] < time.time():
+            return None
+        return orjson.loads(row[0])
+
+    def put(self, key: str, value: Any, ttl: float) -> None:
+        try:
+            blob = orjson.dumps(
+                value, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            )
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO prompt_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, blob, time.time() + ttl),
+                )
+                conn.commit()
+        except (TypeError, sqlite3.Error) as e:
+            print(f"[gemini_engine] 响应缓存写入失败: {e}")
+
+    def clear(self) -> None:
+        try:
+            with self._lock:
+                conn = self._connect()
+                conn.execute("DELETE FROM prompt_cache")
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"[gemini_engine] 响应缓存清空失败: {e}")
+
+
+_prompt_cache_store = _PromptCacheStore(PROMPT_CACHE_PATH)
+
+# 这些返回值代表失败（无 Key、无数据、调用异常），不写入缓存
+_UNCACHEABLE_TEXT_PREFIXES = ("未配置", "看板暂无内容", "洞察生成失败")
+
+# 缓存 key 的版本号：修改 Prompt 或返回结构后递增，旧条目随之失效；模型名同样计入 key
+PROMPT_CACHE_VERSION = 1
+
+
+class _UncachedResult(dict):
+    """模型输出无法解析时的兜底结果：照常返回给调用方，但不写入缓存，下次同样的请求会重新调用模型。"""
+
+
+def _is_cacheable_result(result: Any) -> bool:
+    if isinstance(result, _UncachedResult):
+        return False
+    if isinstance(result, dict):
+        return "error" not in result
+    if isinstance(result, str):
+        return not result.startswith(_UNCACHEABLE_TEXT_PREFIXES)
+    return result is not None
+
+
+def _prompt_cache_key(fn_name: str, params: Dict[str, Any], data_dependent: bool) -> Optional[str]:
+    """函数名 + 全部参数 (+ 元数据指纹) + Prompt 版本与模型名的 SHA-256；参数无法序列化时返回 None（不缓存）。"""
+    meta_version = ""
+    if data_dependent:
+        get_cached_data()
+        meta_version = _cached_meta_hash
+    try:
+        payload = orjson.dumps(
+            {
+                "fn": fn_name,
+                "args": params,
+                "v": meta_version,
+                "pv": PROMPT_CACHE_VERSION,
+                "models": (FAST_MODEL, DEEP_MODEL, MODEL_CHART),
+            },
+            default=str,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
+    except TypeError:
+        return None
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _prompt_cache(ttl: float = PROMPT_CACHE_TTL, data_dependent: bool = True):
+    """
+    Gemini 调用的精确缓存装饰器：key 为函数名 + 全部参数 (+ 元数据指纹) 的 SHA-256。
+    data_dependent=True 时结果依赖已加载的数据，元数据变化后自动失效；传入 DataFrame 参数的调用不缓存。
+    """
+    def decorator(fn):
+        sig = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            params = bound.arguments
+            if any(isinstance(v, pd.DataFrame) for v in params.values()):
+                return fn(*args, **kwargs)
+            key = _prompt_cache_key(fn.__qualname__, params, data_dependent)
+            if key is None:
+                return fn(*args, **kwargs)
+            cached = _prompt_cache_store.get(key)
+            if cached is not None:
+                return cached
+            result = fn(*args, **kwargs)
+            if _is_cacheable_result(result):
+                _prompt_cache_store.put(key, result, ttl)
+            return result
+
+        return wrapper
+    return decorator
+
+
+class _SemanticCache:
+    """
+    向量相似度缓存：所有条目的单位向量堆叠成一个矩阵，查询时一次矩阵乘法得到全部余弦相似度。
+    scope 区分用途与上下文（历史、元数据指纹），只有 scope 相同的条目才可能命中；满时淘汰最久未用的条目。
+    """
+
+    def __init__(self, maxsize: int, threshold: float):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._clear_locked()
+
+    def _clear_locked(self) -> None:
+        self._matrix: Optional[np.ndarray] = None
+        self._scopes: List[str] = []
+        self._values: List[Any] = []
+        self._last_used: List[int] = []
+        self._tick = 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear_locked()
+
+    def get(self, scope: str, emb: np.ndarray) -> Any:
+        with self._lock:
+            if self._matrix is None:
+                return None
+            sims = self._matrix @ emb
+            sims[[s != scope for s in self._scopes]] = -1.0
+            idx = int(np.argmax(sims))
+            if sims[idx] < self.threshold:
+                return None
+            self._tick += 1
+            self._last_used[idx] = self._tick
+            return self._values[idx]
+
+    def put(self, scope: str, emb: np.ndarray, value: Any) -> None:
+        with self._lock:
+            self._tick += 1
+            if self._matrix is None:
+                self._matrix = emb[np.newaxis, :].copy()
+            elif len(self._values) >= self.maxsize:
+                idx = int(np.argmin(self._last_used))
+                self._matrix[idx] = emb
+                self._scopes[idx], self._values[idx], self._last_used[idx] = scope, value, self._tick
+                return
+            else:
+                self._matrix = np.vstack([self._matrix, emb])
+            self._scopes.append(scope)
+            self._values.append(value)
+            self._last_used.append(self._tick)
+
+
+_intent_semantic_cache = _SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
+
+
+def _embed(client, text: str) -> Optional[np.ndarray]:
+    """用 Gemini 向量模型计算文本的单位向量；失败时返回 None（语义缓存随之跳过）。"""
+    try:
+        resp = client.models.embed_content(model=EMBED_MODEL, contents=text)
+        vec = np.asarray(resp.embeddings[0].values, dtype=np.float32)
+    except Exception as e:
+        print(f"[gemini_engine] 向量计算失败，跳过语义缓存: {e}")
+        return None
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm > 0 else None
+
+
+def _snapshot_signature() -> Tuple:
+    names = [FIXED_FILE_NAME, CLIENT_FILE_NAME, *EXTRA_FILES.values()]
+    return (SNAPSHOT_VERSION, PARQUET_CACHE_VERSION) + tuple(_source_signature(os.path.join(DATA_DIR, n)) for n in names)
+
+
+def _load_snapshot() -> Optional[Tuple[Dict[str, pd.DataFrame], Dict[str, Any], str]]:
+    """读取与当前源文件签名一致的快照，返回 (dfs_map, time_context, meta_data)。"""
+    if not os.path.exists(SNAPSHOT_PATH):
+        return None
+    try:
+        with open(SNAPSHOT_PATH, "rb") as f:
+            sig, dfs_map, time_context, meta_data = pickle.load(f)
+    except Exception as e:
+        print(f"[gemini_engine] 快照读取失败，重新加载数据: {e}")
+        return None
+    if sig != _snapshot_signature() or "hcm" not in dfs_map:
+        return None
+    return dfs_map, time_context, meta_data
+
+
+def _save_snapshot(dfs_map: Dict[str, pd.DataFrame], time_context: Dict[str, Any], meta_data: str) -> None:
+    tmp_path = SNAPSHOT_PATH + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump((_snapshot_signature(), dfs_map, time_context, meta_data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, SNAPSHOT_PATH)
+    except Exception as e:
+        print(f"[gemini_engine] 快照写入失败: {e}")
+
+
+def _compose_metadata(df: pd.DataFrame, dfs_map: Dict[str, pd.DataFrame], time_context: Dict[str, Any]) -> str:
     # 增强 Metadata 构建，包含所有表格信息
     meta_lines = []
     meta_lines.append(f"### 主表 (df): {len(df)} 行, 列: {list(df.columns)}")
@@ -396,33 +1037,103 @@ def get_cached_data() -> Tuple[Optional[pd.DataFrame], Optional[Dict[str, pd.Dat
              meta_lines.append(f"### 附表 ({k} -> df_{k}): {len(v)} 行, 列: {list(v.columns)}")
              
     # 保留原有的详细 Metadata 构建逻辑，主要针对主表
-    base_meta = build_metadata(df, _cached_time_context)
-    _cached_meta_data = "\n".join(meta_lines) + "\n\n" + base_meta
-    
+    base_meta = _build_metadata_cached(df, time_context)
+    return "\n".join(meta_lines) + "\n\n" + base_meta
+
+
+def get_cached_data() -> Tuple[Optional[pd.DataFrame], Optional[Dict[str, pd.DataFrame]], Optional[Dict], Optional[str]]:
+    """获取或构建缓存的 df, dfs_map, time_context, meta_data。线程安全（双重检查加锁）。"""
+    global _cached_df, _cached_dfs, _cached_time_context, _cached_meta_data, _cached_meta_hash
+    global _cached_meta_header, _cached_meta_preview, _base_exec_ctx, _cached_available_tables_str
+    if _cached_df is not None:
+        return _cached_df, _cached_dfs, _cached_time_context, _cached_meta_data
+
+    with _data_lock:
+        if _cached_df is not None:
+            return _cached_df, _cached_dfs, _cached_time_context, _cached_meta_data
+
+        snapshot = _load_snapshot()
+        if snapshot is not None:
+            dfs_map, time_context, meta_data = snapshot
+            df = dfs_map["hcm"]
+        else:
+            df, dfs_map, _ = load_data()
+            if df is None:
+                return None, {}, None, None
+            time_context = analyze_time_structure(df)
+            meta_data = _compose_metadata(df, dfs_map, time_context)
+            _save_snapshot(dfs_map, time_context, meta_data)
+
+        _cached_dfs = dfs_map
+        _cached_time_context = time_context
+        _cached_meta_data = meta_data
+        _cached_meta_hash = hashlib.blake2b(meta_data.encode("utf-8"), digest_size=16).hexdigest()
+        # _compose_metadata 的头部与详情以空行分隔
+        _cached_meta_header = meta_data.split("\n\n", 1)[0]
+        _cached_meta_preview = {
+            "rows": len(df),
+            "columns": list(df.columns),
+            "meta_data_length": len(meta_data),
+            "meta_data_preview": meta_data[:3000],
+        }
+        _base_exec_ctx = {"pd": pd, "np": np, **{f"df_{k}": v for k, v in dfs_map.items()}, "df": df}
+        _cached_available_tables_str = ", ".join(
+            ["df (主表)"] + [f"df_{k} ({k}表)" for k in dfs_map if k != "hcm"]
+        )
+        # 最后赋值 _cached_df：无锁快路径看到它非空时，其余字段已就绪
+        _cached_df = df
+
     print(f"[gemini_engine] 元数据已构建。主表 {len(df)} 行。附表 keys: {list(dfs_map.keys())}")
     return _cached_df, _cached_dfs, _cached_time_context, _cached_meta_data
 
 
 def clear_cache():
     """清除缓存，下次请求时会重新加载数据和构建元数据。"""
-    global _cached_df, _cached_time_context, _cached_meta_data, _client
-    _cached_df = None
-    _cached_time_context = None
-    _cached_meta_data = None
-    _client = None
+    global _cached_df, _cached_time_context, _cached_meta_data, _cached_meta_hash, _client
+    global _cached_meta_header, _cached_meta_preview, _base_exec_ctx, _cached_available_tables_str
+    with _data_lock:
+        _cached_df = None
+        _cached_time_context = None
+        _cached_meta_data = None
+        _cached_meta_hash = ""
+        _cached_meta_header = ""
+        _cached_meta_preview = {}
+        _base_exec_ctx = {"pd": pd, "np": np}
+        _cached_available_tables_str = ""
+    with _client_lock:
+        _client = None
+    with _llm_cache_lock:
+        _router_cache.clear()
+        _plan_cache.clear()
+    _intent_semantic_cache.clear()
+    _prompt_cache_store.clear()
     print("[gemini_engine] 缓存已清除")
 
 
 def get_metadata_preview() -> Dict[str, Any]:
     """获取当前元数据预览，用于调试。"""
-    df, dfs_map, time_context, meta_data = get_cached_data()
+    df, _, _, _ = get_cached_data()
     if df is None:
         return {"error": "数据未加载"}
+    return dict(_cached_meta_preview)
+
+
+# 无需调用模型即可判定为 irrelevant 的输入（问候 / 帮助 / 测试），按 _normalize_query 之后的形式匹配
+TRIVIAL_QUERIES = frozenset({"你好", "您好", "hi", "hello", "help", "帮助", "?", "？", "测试", "test"})
+MAX_QUERY_CHARS = 4000
+
+
+def is_trivial_query(query_text: str) -> bool:
+    return _normalize_query(query_text) in TRIVIAL_QUERIES
+
+
+def irrelevant_result() -> Dict[str, Any]:
     return {
-        "rows": len(df),
-        "columns": list(df.columns),
-        "meta_data_length": len(meta_data) if meta_data else 0,
-        "meta_data_preview": meta_data[:3000] if meta_data else "",
+        "data": [],
+        "title": "无法处理",
+        "logicDescription": "当前提问与数据内容无关。",
+        "config": {},
+        "mode": "irrelevant",
     }
 
 
@@ -434,36 +1145,70 @@ def identify_intent(query_text: str, history_context: str = "") -> str:
     client = _get_client()
     if not client:
         return "single_query"  # 无 API Key 默认走简单模式
-
-    meta_data = get_metadata_preview()
+    if is_trivial_query(query_text):
+        return "irrelevant"
+
+    # 意图分类只需各表行数与列名，不传完整元数据
+    get_cached_data()
+    meta_data = _cached_meta_header
+    cache_key = _llm_cache_key(_normalize_query(query_text), history_context, _cached_meta_hash)
+    cached = _lru_get(_router_cache, cache_key)
+    if cached is not None:
+        return cached
+    # 精确缓存未命中时再查语义缓存：同一上下文下措辞不同但意思相同的问题复用意图。
+    # 向量在后台计算，只短暂等待；来不及或失败时不拖慢路由调用
+    sem_scope = _llm_cache_key("intent", history_context, _cached_meta_hash)
+    emb_future = _embed_executor.submit(_embed, client, _normalize_query(query_text))
+    try:
+        emb = emb_future.result(timeout=SEMANTIC_EMBED_TIMEOUT)
+    except FuturesTimeout:
+        emb = None
+    if emb is not None:
+        cached = _intent_semantic_cache.get(sem_scope, emb)
+        if cached is not None:
+            _lru_put(_router_cache, cache_key, cached)
+            return cached
+
+    # Prompt 顺序：静态指令 -> 元数据 -> 历史 -> 问题，前缀保持不变以命中模型侧的前缀缓存
     router_prompt = f"""
 你是一个意图分类器。根据用户问题和历史上下文，判断用户意图。
 
-【元数据】{meta_data}
-【历史记录】{history_context}
-
-【用户问题】{query_text}
-
 类别：
 1. "single_query": 简单问题，一个表格/图表即可回答。例如"2024年销售额排名"、"各省份份额"。
 2. "multi_table": 复杂问题，需要从多个角度或生产多个表格才能完整回答。例如"分析Top3产品的区域分布及增长趋势"（需要先算Top3，再分别算3个产品的区域详情，或产出多个表）。
 3. "irrelevant": 与医药数据完全无关的闲聊、通用知识问答（如天气、历史）、情感问题或敏感话题。
 
 仅输出 JSON: {{"type": "single_query" 或 "multi_table" 或 "irrelevant"}}
+
+【元数据】{meta_data}
+【历史记录】{history_context}
+
+【用户问题】{query_text}
 """
     try:
-        from google.genai import types
         router_resp = _safe_generate_content(
             client,
             FAST_MODEL,  # 1. Intent Identification (fast_model)
             router_prompt,
-            config=types.GenerateContentConfig(response_mime_type="application/json"),
+            config=JSON_CFG,
         )
-        return json.loads(router_resp.text).get("type", "single_query")
+        intent = orjson.loads(router_resp.text).get("type", "single_query")
     except Exception:
         return "single_query"
+    _lru_put(_router_cache, cache_key, intent)
+    if emb is not None:
+        _intent_semantic_cache.put(sem_scope, emb, intent)
+    else:
+        # 向量尚未算完：完成后再写入语义缓存（失败时 _embed 返回 None，直接跳过）
+        def _store(fut):
+            late = fut.result()
+            if late is not None:
+                _intent_semantic_cache.put(sem_scope, late, intent)
+        emb_future.add_done_callback(_store)
+    return intent
 
 
+@_prompt_cache()
 def process_query_with_gemini(
     query_text: str,
     df: Optional[pd.DataFrame] = None,
@@ -476,7 +1221,6 @@ def process_query_with_gemini(
     - 始终包含 data, title, logicDescription, config（供前端图表/表格和「保存到看板」）
     - 可选 mode, summary, tables, intent_analysis, angles, insight
     """
-    from google.genai import types
 
     client = _get_client()
     if client is None:
@@ -491,31 +1235,23 @@ def process_query_with_gemini(
         _, dfs_map, _, _ = get_cached_data()
 
     mat_list = time_context.get("mat_list", [])
-    mat_list_prior = time_context.get("mat_list_prior", [])
     ytd_list = time_context.get("ytd_list", [])
-    ytd_list_prior = time_context.get("ytd_list_prior", [])
 
     # 1. 意图路由
     intent_type = identify_intent(query_text, history_context)
 
     if intent_type == "irrelevant":
-        return {
-            "data": [],
-            "title": "无法处理",
-            "logicDescription": "当前提问与数据内容无关。",
-            "config": {},
-            "mode": "irrelevant",
-        }
+        return irrelevant_result()
 
     # 2. Multi-Table Plan 模式 (新)
     if intent_type == "multi_table":
-        plan_prompt = f"""
-你是一位医药行业 BI 专家。用户问题："{query_text}"
-需要通过多个数据表格来完整回答。请规划需要生产哪些表格。
+        plan_key = _llm_cache_key(_normalize_query(query_text), history_context, _cached_meta_hash)
+        cached_plan = _lru_get(_plan_cache, plan_key)
+        if cached_plan is not None:
+            return dict(cached_plan)
 
-【元数据】{meta_data}
-【历史记录】{history_context}
-【时间上下文】MAT: {mat_list}, YTD: {ytd_list}
+        plan_prompt = f"""
+你是一位医药行业 BI 专家。用户问题需要通过多个数据表格来完整回答。请规划需要生产哪些表格。
 
 请列出需要生成的表格清单。每个表格需要包含：
 - id: 序号 (1, 2, 3...)
@@ -524,42 +1260,41 @@ def process_query_with_gemini(
 - logic: 简要计算/筛选逻辑描述
 
 输出 JSON: {{ "plan": [ {{ "id": 1, "title": "...", "description": "...", "logic": "..." }} ] }}
+
+【元数据】{meta_data}
+【时间上下文】MAT: {mat_list}, YTD: {ytd_list}
+【历史记录】{history_context}
+
+【用户问题】"{query_text}"
 """
         try:
             response_plan = _safe_generate_content(
                 client, 
                 DEEP_MODEL,
                 plan_prompt,
-                config=types.GenerateContentConfig(response_mime_type="application/json"),
+                config=JSON_CFG,
             )
             _, plan_json = parse_response(response_plan.text)
-            return {
+            plan_result = {
                 "mode": "plan_confirmation",
                 "plan": plan_json.get("plan", []),
                 "title": "生产计划确认",
                 "logicDescription": f"即将在看板中生成 {len(plan_json.get('plan', []))} 个表格，请确认。",
                 "config": {}
             }
+            _lru_put(_plan_cache, plan_key, plan_result)
+            return dict(plan_result)
         except Exception as e:
             return {"error": f"生成计划失败: {e}"}
 
     # 3. Single Query 模式 (相当于原来的 Simple，但去除了分析部分，仅保留 "auto" 逻辑)
     # 只要不是多表，就默认单表直接出
     
-    # 动态构建可用表格提示
-    available_tables = ["df (主表)"]
-    if dfs_map:
-        for k in dfs_map:
-            if k != 'hcm':
-                available_tables.append(f"df_{k} ({k}表)")
-    available_tables_str = ", ".join(available_tables)
+    # 可用表格提示在数据加载时已构建好，保持 Prompt 前缀逐字节稳定
+    available_tables_str = _cached_available_tables_str
     
     simple_prompt = f"""
-你是一位医药行业的 Pandas 数据处理专家。用户需求："{query_text}"
-【元数据】{meta_data}
-【历史记录】{history_context}
-【时间上下文】MAT: {mat_list}, YTD: {ytd_list}
-【可用表格】{available_tables_str}
+你是一位医药行业的 Pandas 数据处理专家。请根据文末的用户需求编写取数代码。
 
 【关键指令 - 必须遵守】
 1. 数据源：环境中存在 {available_tables_str}。
@@ -579,13 +1314,20 @@ def process_query_with_gemini(
     "summary": {{ "intent": "意图描述", "scope": "数据范围", "metrics": "指标", "logic": "计算逻辑" }},
     "code": "df_sub = df[...]\\nresults = {{'标题': df_sub}}"
 }}
+
+【元数据】{meta_data}
+【时间上下文】MAT: {mat_list}, YTD: {ytd_list}
+【可用表格】{available_tables_str}
+【历史记录】{history_context}
+
+【用户需求】"{query_text}"
 """
     try:
         simple_resp = _safe_generate_content(
             client,
             DEEP_MODEL,  # Single Query (deep_model)
             simple_prompt,
-            config=types.GenerateContentConfig(response_mime_type="application/json"),
+            config=JSON_CFG,
         )
         _, simple_json = parse_response(simple_resp.text)
     except Exception as e:
@@ -594,27 +1336,9 @@ def process_query_with_gemini(
     if not simple_json or "code" not in simple_json:
         return {"error": "无法解析生成的代码格式，请重试。"}
 
-    exec_ctx = {
-        "df": df,
-        "pd": pd,
-        "np": np,
-        "pd": pd,
-        "np": np,
-        "results": {},
-        "result": None,
-        "current_mat": mat_list,
-        "mat_list": mat_list,
-        "prior_mat": mat_list_prior,
-        "mat_list_prior": mat_list_prior,
-        "ytd_list": ytd_list,
-        "ytd_list_prior": ytd_list_prior,
-    }
+    exec_ctx = _new_exec_ctx(df, time_context)
     try:
-        # Inject additional DFs
-        if dfs_map:
-             for k, v in dfs_map.items():
-                 exec_ctx[f"df_{k}"] = v
-        exec(simple_json["code"], exec_ctx)
+        _exec_generated_code(simple_json["code"], exec_ctx)
     except Exception as e:
         return {"error": f"代码执行错误: {e}"}
 
@@ -636,7 +1360,7 @@ def process_query_with_gemini(
     # 表格转成前端可用的列表 of dict
     tables_for_api = {}
     for k, v in formatted.items():
-        tables_for_api[k] = v.replace({np.nan: None}).to_dict(orient="records")
+        tables_for_api[k] = _df_to_full_records(v)
 
     return {
         "data": chart_data,
@@ -665,34 +1389,14 @@ def execute_query_plan(plan_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]
         return []
     
     mat_list = time_context.get("mat_list", [])
-    mat_list_prior = time_context.get("mat_list_prior", [])
     ytd_list = time_context.get("ytd_list", [])
-    ytd_list_prior = time_context.get("ytd_list_prior", [])
 
-    # 动态构建可用表格提示
-    available_tables = ["df (主表)"]
-    if dfs_map:
-        for k in dfs_map:
-            if k != 'hcm':
-                available_tables.append(f"df_{k} ({k}表)")
-    available_tables_str = ", ".join(available_tables)
+    # 可用表格提示在数据加载时已构建好，保持 Prompt 前缀逐字节稳定
+    available_tables_str = _cached_available_tables_str
 
-    results = []
-    
-    for item in plan_items:
-        title = item.get("title", "未命名表格")
-        logic = item.get("logic", "")
-        
-        # 复用 Single Query 的 Prompt 逻辑，但针对该特定 Item
-        item_prompt = f"""
+    # 单表与批量 Prompt 共用的前缀：与具体任务无关，逐字节稳定，便于模型侧前缀缓存命中
+    prompt_prefix = f"""
 你是一位医药行业的 Pandas 数据处理专家。请根据以下具体指令生成表格数据。
-【可用表格】{available_tables_str}
-
-【任务】生成表格："{title}"
-【逻辑描述】{logic}
-
-【元数据】{meta_data}
-【时间上下文】MAT: {mat_list}, YTD: {ytd_list}
 
 【关键指令】
 1. 数据源：环境中存在 {available_tables_str}。
@@ -704,30 +1408,81 @@ def execute_query_plan(plan_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]
 3. 必须包含维度列。
 4. 【Categorical 处理】若使用 pd.qcut/pd.cut，请务必使用 astype(str) 转为字符串，避免 Categorical 类型导致的 setitem 报错。
 
+【元数据】{meta_data}
+【时间上下文】MAT: {mat_list}, YTD: {ytd_list}
+【可用表格】{available_tables_str}
+"""
+
+    def _generate_json(prompt: str) -> Optional[Dict[str, Any]]:
+        resp = _safe_generate_content(
+            client,
+            DEEP_MODEL,
+            prompt,
+            config=JSON_CFG,
+        )
+        _, json_res = parse_response(resp.text)
+        return json_res
+
+    def _generate_item_code(item: Dict[str, Any]) -> Optional[str]:
+        title = item.get("title", "未命名表格")
+        logic = item.get("logic", "")
+        # 复用 Single Query 的 Prompt 逻辑，但针对该特定 Item
+        item_prompt = f"""{prompt_prefix}
+【任务】生成表格："{title}"
+【逻辑描述】{logic}
+
 输出 JSON: {{ "code": "df_sub = df[...]\\nresults = {{'{title}': df_sub}}" }}
 """
+        json_res = _generate_json(item_prompt)
+        if json_res and "code" in json_res:
+            return json_res["code"]
+        return None
+
+    def _generate_batch_codes(batch: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """一次请求为一组表格生成代码；解析失败或缺项的位置返回 None，由调用方逐个回退。"""
+        if len(batch) == 1:
+            return [None]
+        tasks = "\n".join(
+            f"{n}. 表格：\"{item.get('title', '未命名表格')}\"\n   逻辑描述：{item.get('logic', '')}"
+            for n, item in enumerate(batch, 1)
+        )
+        batch_prompt = f"""{prompt_prefix}
+【任务列表】共 {len(batch)} 个表格，请逐个独立生成代码（每段代码单独执行，互不共享变量）：
+{tasks}
+
+输出 JSON: {{ "items": [{{ "index": 1, "code": "df_sub = df[...]\\nresults = {{'<表格标题>': df_sub}}" }}, ...] }}
+items 必须按任务序号一一对应，共 {len(batch)} 项。
+"""
+        codes: List[Optional[str]] = [None] * len(batch)
         try:
-            # 这里的 Prompt 很简单，用 Fast Model 也许够用，或者 Deep
-            resp = _safe_generate_content(
-                client,
-                DEEP_MODEL, 
-                item_prompt,
-                config=types.GenerateContentConfig(response_mime_type="application/json"),
-            )
-            _, json_res = parse_response(resp.text)
-            
-            if json_res and "code" in json_res:
-                exec_ctx = {
-                    "df": df, "pd": pd, "np": np, "results": {},
-                    "mat_list": mat_list, "mat_list_prior": mat_list_prior,
-                    "ytd_list": ytd_list, "ytd_list_prior": ytd_list_prior,
-                }
-                # Inject additional DFs
-                if dfs_map:
-                     for k, v in dfs_map.items():
-                         exec_ctx[f"df_{k}"] = v
-
-                exec(json_res["code"], exec_ctx)
+            json_res = _generate_json(batch_prompt)
+        except Exception as e:
+            print(f"Error generating plan batch: {e}")
+            return codes
+        entries = json_res.get("items") if isinstance(json_res, dict) else None
+        if not isinstance(entries, list):
+            return codes
+        for pos, entry in enumerate(entries):
+            if not isinstance(entry, dict) or not entry.get("code"):
+                continue
+            idx = entry.get("index")
+            idx = idx - 1 if isinstance(idx, int) and 1 <= idx <= len(batch) else pos
+            if idx < len(batch) and codes[idx] is None:
+                codes[idx] = entry["code"]
+        return codes
+
+    def _run_item(job: Tuple[Dict[str, Any], Optional[str]]) -> Optional[Dict[str, Any]]:
+        item, code = job
+        title = item.get("title", "未命名表格")
+        logic = item.get("logic", "")
+        try:
+            if code is None:
+                # 批量结果中缺失该项：单独请求一次
+                code = _generate_item_code(item)
+            if code:
+                # 每个任务独立的执行上下文，线程间不共享 results
+                exec_ctx = _new_exec_ctx(df, time_context)
+                _exec_generated_code(code, exec_ctx)
                 
                 final_res = exec_ctx.get("results")
                 if final_res:
@@ -735,7 +1490,7 @@ def execute_query_plan(plan_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]
                     k = next(iter(final_res))
                     v = normalize_result(final_res[k])
                     
-                    results.append({
+                    return {
                         "id": item.get("id"), # Pass through ID
                         "data": _df_to_chart_data(v),
                         "fullData": _df_to_full_records(v),
@@ -743,12 +1498,19 @@ def execute_query_plan(plan_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]
                         "logicDescription": logic,
                         "mode": "simple",
                         "config": {"dimension": v.columns[0] if len(v.columns)>0 else "", "metric": v.columns[1] if len(v.columns)>1 else ""}
-                    })
+                    }
         except Exception as e:
             print(f"Error executing plan item {title}: {e}")
-            continue
-            
-    return results
+        return None
+
+    if not plan_items:
+        return []
+
+    # 1) 每 PLAN_BATCH_SIZE 个表格合并为一次 Gemini 请求，元数据前缀只发送一次；各批次并发发出
+    batches = [plan_items[i:i + PLAN_BATCH_SIZE] for i in range(0, len(plan_items), PLAN_BATCH_SIZE)]
+    codes = [c for batch_codes in _plan_executor.map(_generate_batch_codes, batches) for c in batch_codes]
+    # 2) 并发执行各表格代码（缺失的单独补请求）；map 保持原顺序
+    return [r for r in _plan_executor.map(_run_item, zip(plan_items, codes)) if r is not None]
 
 def generate_market_research_plan(
     query_text: str,
@@ -775,7 +1537,7 @@ def generate_market_research_plan(
 
     research_prompt = f"""
 你是一位资深医药市场分析专家，拥有丰富的行业经验和数据分析能力。
-用户正在进行市场调研，问题是："{query_text}"
+用户正在进行市场调研，问题见文末。
 
 【可用数据源】
 1. **互联网 (Internet)**: 获取最新的定性信息、新闻、政策、竞品动态、非结构化数据。
@@ -784,12 +1546,6 @@ def generate_market_research_plan(
    - `df_fact` (如有): 厂家实际销售/财务数据。
    - `df_ipm` (如有): 行业宏观/IPM市场数据。
 
-【元数据摘要】
-{meta_data}
-
-【历史上下文】
-{history_context}
-
 你的任务是设计一个【完整的调研方案】，包括：
 1. 整体调研策略和思路
 2. 具体的执行步骤，每步明确从哪里获取什么信息
@@ -808,13 +1564,21 @@ def generate_market_research_plan(
     }}
   ]
 }}
+
+【元数据摘要】
+{meta_data}
+
+【历史上下文】
+{history_context}
+
+【调研问题】"{query_text}"
 """
     try:
         response = _safe_generate_content(
             client,
             DEEP_MODEL,
             research_prompt,
-            config=types.GenerateContentConfig(response_mime_type="application/json"),
+            config=JSON_CFG,
         )
         _, json_res = parse_response(response.text)
         
@@ -832,6 +1596,7 @@ def generate_market_research_plan(
         return {"error": f"市场调研规划失败: {e}"}
 
 
+@_prompt_cache(data_dependent=False)
 def suggest_chart(data: List[Dict[str, Any]], title: str = "", custom_prompt: str = "") -> Dict[str, Any]:
     """
     调用 Gemini 分析数据并推荐最佳图表类型。
@@ -948,12 +1713,11 @@ def suggest_chart(data: List[Dict[str, Any]], title: str = "", custom_prompt: st
 """
     
     try:
-        from google.genai import types
         response = _safe_generate_content(
             client,
             MODEL_CHART,
             prompt,
-            config=types.GenerateContentConfig(response_mime_type="application/json"),
+            config=JSON_CFG,
         )
         _, result_json = parse_response(response.text)
         if result_json and "chartType" in result_json:
@@ -963,39 +1727,33 @@ def suggest_chart(data: List[Dict[str, Any]], title: str = "", custom_prompt: st
                 "config": result_json.get("config", {}),
             }
         else:
-            return {"chartType": "bar", "reason": "默认推荐柱状图", "config": {}}
+            return _UncachedResult(chartType="bar", reason="默认推荐柱状图", config={})
     except Exception as e:
         return {"error": f"图表推荐调用失败: {e}"}
 
 
-def generate_dashboard_insight(dashboard_items: List[Dict[str, Any]]) -> str:
-    """
-    基于看板内所有图表数据生成综合洞察。
-    """
-    client = _get_client()
-    if client is None:
-        return "未配置 GENAI_API_KEY，无法生成洞察。"
+INSIGHT_PREVIEW_ROWS = 10
+# 洞察缓存条目的函数名部分（流式生成没有走 _prompt_cache 装饰器，key 需显式给出）
+INSIGHT_CACHE_KEY = "stream_dashboard_insight"
 
-    if not dashboard_items:
-        return "看板暂无内容，无法生成洞察。"
 
-    # 构建数据摘要
-    data_summary = []
+def _iter_insight_summary(dashboard_items: List[Dict[str, Any]]) -> Iterator[str]:
+    """逐个图表产出数据摘要片段，每个图表只取前几行（截断数据以防 Prompt 过长）。"""
     for item in dashboard_items:
         title = item.get("title", "未命名图表")
         data = item.get("renderData") or item.get("config", {}).get("data") or []
-        
-        # 截断数据以防 Prompt 过长
-        preview_data = data[:10] if isinstance(data, list) else str(data)[:500]
-        data_summary.append(f"【图表: {title}】\n数据预览: {preview_data}\n")
+        preview_data = list(islice(data, INSIGHT_PREVIEW_ROWS)) if isinstance(data, list) else str(data)[:500]
+        yield f"【图表: {title}】\n数据预览: {preview_data}\n"
 
-    combined_data_text = "\n".join(data_summary)
-    
-    prompt = f"""
-你是一位高级商业分析师。请基于以下看板中的多个图表数据，生成一份综合性的深度商业洞察报告。
 
-【看板数据摘要】
-{combined_data_text}
+def _build_insight_prompt(dashboard_items: List[Dict[str, Any]]) -> str:
+    buf = io.StringIO()
+    buf.write("\n你是一位高级商业分析师。请基于以下看板中的多个图表数据，生成一份综合性的深度商业洞察报告。\n\n【看板数据摘要】\n")
+    for i, part in enumerate(_iter_insight_summary(dashboard_items)):
+        if i:
+            buf.write("\n")
+        buf.write(part)
+    buf.write("""
 
 【要求】
 1. **综合分析**：不要孤立地描述每个图表，尝试寻找图表之间的关联、冲突或共同趋势。
@@ -1004,16 +1762,52 @@ def generate_dashboard_insight(dashboard_items: List[Dict[str, Any]]) -> str:
 4. **简洁有力**：总字数控制在 300-500 字之间。语言专业、客观。
 
 请输出 Markdown 格式的通过文本。
-"""
+""")
+    return buf.getvalue()
 
-    try:
-        from google.genai import types
-        # 使用 Deep Model 进行深度分析
-        response = _safe_generate_content(
-            client,
-            DEEP_MODEL,
-            prompt,
-        )
-        return response.text
-    except Exception as e:
-        return f"洞察生成失败: {e}"
+
+class InsightUnavailable(Exception):
+    """无法生成洞察的前置条件错误（未配置 Key、看板为空），在开始输出前抛出。"""
+
+
+def stream_dashboard_insight(dashboard_items: List[Dict[str, Any]], retries: int = 3) -> Iterator[str]:
+    """
+    基于看板内所有图表数据生成综合洞察，逐块产出 Markdown 文本。
+    完整生成成功后才写入缓存，命中缓存时一次性产出。
+    失败不再以文本形式产出：前置条件不满足抛 InsightUnavailable，模型调用失败原样抛出，由调用方决定如何告知前端。
+    """
+    client = _get_client()
+    if client is None:
+        raise InsightUnavailable("未配置 GENAI_API_KEY，无法生成洞察。")
+    if not dashboard_items:
+        raise InsightUnavailable("看板暂无内容，无法生成洞察。")
+
+    key = _prompt_cache_key(INSIGHT_CACHE_KEY, {"dashboard_items": dashboard_items}, False)
+    cached = _prompt_cache_store.get(key) if key is not None else None
+    if cached is not None:
+        yield cached
+        return
+
+    prompt = _build_insight_prompt(dashboard_items)
+    chunks: List[str] = []
+    for i in range(retries):
+        try:
+            for chunk in client.models.generate_content_stream(
+                model=DEEP_MODEL,
+                contents=prompt,
+                config=_DEFAULT_CFG,
+            ):
+                text = chunk.text
+                if text:
+                    chunks.append(text)
+                    yield text
+            break
+        except Exception as e:
+            err = str(e)
+            # 只有尚未输出任何内容时才能安全重试
+            if not chunks and ("429" in err or "RESOURCE_EXHAUSTED" in err) and i < retries - 1:
+                time.sleep(5 * (2**i))
+                continue
+            raise
+    if key is not None and chunks:
+        _prompt_cache_store.put(key, "".join(chunks), PROMPT_CACHE_TTL)
@@ -1,27 +1,57 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+import asyncio
+import os
+import orjson
 from .engine import data_engine
 from . import gemini_engine
 
 app = FastAPI(title="PharmCube BI Backend")
 
-# 允许跨域 (前端 React 在 3000/5173，后端在 8000)
+
+def _orjson_default(obj: Any) -> Any:
+    """orjson 不能原生序列化的类型兜底：pandas 时间戳、numpy/pandas 标量及其他对象。"""
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    if hasattr(obj, "item"):
+        return obj.item()
+    return jsonable_encoder(obj)
+
+
+class OrjsonResponse(Response):
+    """用 orjson 直接序列化大结果集（numpy 数组 / NaN -> null），跳过 jsonable_encoder 的逐项遍历。"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_orjson_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+
+# 允许跨域 (前端 React 在 3000/5173，后端在 8000)；部署到其他域名时用 CORS_ORIGINS（逗号分隔）覆盖
+DEFAULT_CORS_ORIGINS = [
+    "http://localhost:3000",
+    "http://localhost:5173",
+    "http://127.0.0.1:3000",
+    "http://127.0.0.1:5173",
+]
+CORS_ORIGINS = [o.strip() for o in os.environ.get("CORS_ORIGINS", "").split(",") if o.strip()] or DEFAULT_CORS_ORIGINS
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["content-type", "if-none-match"],
+    max_age=86400,  # 预检结果让浏览器缓存一天
 )
 
-@app.on_event("startup")
-async def startup_event():
-    """Server Startup: Preload Data"""
-    print("Preloading data...")
-    # Run in threadpool to avoid blocking event loop, though startup is sync-ish here
-    # gemini_engine.get_cached_data()  # Direct call might block, but better here than request
+def _preload_data():
     try:
         gemini_engine.get_cached_data()
         print("Data preloaded successfully.")
@@ -29,6 +59,20 @@ async def startup_event():
         print(f"Data preload failed: {e}")
 
 
+@app.on_event("startup")
+async def startup_event():
+    """Server Startup: 在后台线程预加载数据，不阻塞启动；预加载完成前到达的请求会在 get_cached_data 的锁上等待"""
+    print("Preloading data...")
+    # 任务句柄挂在 app.state 上：既防止被 GC 回收，也便于需要时 await 预加载完成
+    app.state.preload = asyncio.create_task(asyncio.to_thread(_preload_data))
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """Server Shutdown: 写出尚未落盘的看板数据"""
+    db_writer.flush()
+
+
 
 # --- 数据模型 ---
 class QueryRequest(BaseModel):
@@ -49,47 +93,272 @@ class ExecutePlanRequest(BaseModel):
     items: List[Dict[str, Any]]
 
 # --- 模拟数据库 (文件持久化) ---
-import json
-import os
+import hashlib
+import re
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
 DASHBOARDS_FILE = os.path.join(gemini_engine.DATA_DIR, "dashboards.json")
 ITEMS_FILE = os.path.join(gemini_engine.DATA_DIR, "dashboard_items.json")
+# 随仓库提供的示例看板（renderData 内嵌）。运行时文件不存在时从这里初始化；运行时文件不入库，避免提交后丢失图表数据
+SEED_DIR = os.path.join(gemini_engine.DATA_DIR, "seed")
+# 每个图表的 renderData 单独存为 items/<id>.json，主索引文件只保留元信息，改一张图不必重写全部数据
+RENDER_DATA_DIR = os.path.join(gemini_engine.DATA_DIR, "items")
+_SAFE_ID_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+# 默认紧凑输出；设置 DB_PRETTY_JSON=1 时缩进，便于调试时人工查看
+DB_JSON_OPTS = orjson.OPT_NON_STR_KEYS | (
+    orjson.OPT_INDENT_2 if os.environ.get("DB_PRETTY_JSON") == "1" else 0
+)
 
-def load_db():
-    global dashboards_db, dashboard_items_db
-    if os.path.exists(DASHBOARDS_FILE):
+DEFAULT_DASHBOARDS = [{"id": "default", "name": "默认看板", "createdAt": "2024-01-01"}]
+
+
+def _read_json_list(path: str, default: List[dict]) -> List[dict]:
+    """读取运行时文件；不存在时读 seed/ 下的同名示例文件；都读不到时用 default。"""
+    if not os.path.exists(path):
+        path = os.path.join(SEED_DIR, os.path.basename(path))
+    if os.path.exists(path):
         try:
-            with open(DASHBOARDS_FILE, "r", encoding="utf-8") as f:
-                dashboards_db = json.load(f)
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
         except Exception:
-            dashboards_db = [{"id": "default", "name": "默认看板", "createdAt": "2024-01-01"}]
+            pass
+    return [dict(d) for d in default]
+
+
+def load_db():
+    """读入看板与图表，按 id 建立有序索引（dict 保持文件中的顺序，写盘时按此顺序输出）。"""
+    global dashboards_by_id, items_by_id
+    dashboards_by_id = {d["id"]: d for d in _read_json_list(DASHBOARDS_FILE, DEFAULT_DASHBOARDS)}
+    items_by_id = {i["id"]: i for i in _read_json_list(ITEMS_FILE, [])}
+    # 索引中不含 renderData 的图表，其数据在 sidecar 文件里，首次 GET 时再读入
+    db_writer.render_on_disk = {item_id for item_id, i in items_by_id.items() if "renderData" not in i}
+    _rebuild_items_index()
+
+
+def _render_data_path(item_id: str) -> str:
+    """id 来自前端，不能直接拼路径：非常规字符的 id 用摘要作文件名。"""
+    if _SAFE_ID_RE.fullmatch(item_id):
+        name = item_id
     else:
-        dashboards_db = [{"id": "default", "name": "默认看板", "createdAt": "2024-01-01"}]
-        
-    if os.path.exists(ITEMS_FILE):
+        name = "h_" + hashlib.blake2b(item_id.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(RENDER_DATA_DIR, f"{name}.json")
+
+
+def _ensure_render_data(item: dict) -> dict:
+    """按需从 sidecar 文件读入 renderData（只读一次，之后常驻内存）。"""
+    if "renderData" not in item:
         try:
-            with open(ITEMS_FILE, "r", encoding="utf-8") as f:
-                dashboard_items_db = json.load(f)
-        except Exception:
-            dashboard_items_db = []
-    else:
-        dashboard_items_db = []
+            with open(_render_data_path(item["id"]), "rb") as f:
+                item["renderData"] = orjson.loads(f.read())
+        except FileNotFoundError:
+            item["renderData"] = None
+    return item
+
+def _write_json_atomic(path: str, data: Any) -> None:
+    """先写临时文件、fsync 后再 os.replace，写到一半崩溃或断电也不会留下损坏的 JSON。"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(data, default=_orjson_default, option=DB_JSON_OPTS))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class DBWriter:
+    """
+    合并写盘：变更只标记脏文件，FLUSH_INTERVAL 秒后由后台定时器统一写出，突发的多次变更只序列化一次。
+    batch() 内的变更在退出时才开始计时；写盘失败的文件在 retry_interval 秒后重试；进程退出前调用 flush() 落盘。
+    请求线程只做内存修改与标记，序列化、fsync 都在定时器线程上完成。
+    """
 
-def save_db():
-    try:
-        with open(DASHBOARDS_FILE, "w", encoding="utf-8") as f:
-            json.dump(dashboards_db, f, ensure_ascii=False, indent=2)
-        with open(ITEMS_FILE, "w", encoding="utf-8") as f:
-            json.dump(dashboard_items_db, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Error saving DB: {e}")
+    def __init__(self, interval: float, retry_interval: float):
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()  # 同一时刻只有一个 flush 在写文件
+        self._timer = None
+        self._batch_depth = 0
+        # 每个文件的内容版本号，任何变更都会递增；用于生成 GET 接口的 ETag
+        self.versions: Dict[str, int] = defaultdict(int)
+        self._render_dirty = set()  # renderData 待写出的 item id
+        self._render_deleted = set()  # sidecar 待删除的 item id
+        # sidecar 文件与内存一致的 item id；不在其中且带 renderData 的图表，写索引前须先写出 sidecar
+        self.render_on_disk = set()
+
+    def _targets(self):
+        return {
+            "dashboards": (DASHBOARDS_FILE, list(dashboards_by_id.values())),
+            "items": (ITEMS_FILE, [_strip_render_data(i) for i in list(items_by_id.values())]),
+        }
+
+    def mark_render_dirty(self, item_id: str) -> None:
+        """图表的 renderData 变了：只重写它自己的 sidecar 文件。"""
+        with self._lock:
+            self.versions["items"] += 1
+            self._render_deleted.discard(item_id)
+            self._render_dirty.add(item_id)
+            if self._batch_depth == 0:
+                self._schedule_locked()
+
+    def mark_render_deleted(self, *item_ids: str) -> None:
+        with self._lock:
+            for item_id in item_ids:
+                self._render_dirty.discard(item_id)
+                self._render_deleted.add(item_id)
+            if self._batch_depth == 0:
+                self._schedule_locked()
+
+    def mark_dirty(self, *names: str) -> None:
+        with self._lock:
+            for name in names:
+                self.versions[name] += 1
+            self._dirty.update(names)
+            if self._batch_depth == 0:
+                self._schedule_locked()
+
+    def _schedule_locked(self, delay: Optional[float] = None) -> None:
+        if self._timer is None and (self._dirty or self._render_dirty or self._render_deleted):
+            self._timer = threading.Timer(self.interval if delay is None else delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    @contextmanager
+    def batch(self):
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._schedule_locked()
+
+    def _flush_render_data(self, render_dirty: set, render_deleted: set) -> set:
+        """写出/删除 sidecar 文件，返回写失败的 item id。"""
+        failed = set()
+        for item_id in render_deleted:
+            self.render_on_disk.discard(item_id)
+            try:
+                os.remove(_render_data_path(item_id))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Error removing render data ({item_id}): {e}")
+        os.makedirs(RENDER_DATA_DIR, exist_ok=True)
+        for item_id in render_dirty:
+            item = items_by_id.get(item_id)
+            if item is None or "renderData" not in item:
+                continue
+            try:
+                _write_json_atomic(_render_data_path(item_id), item["renderData"])
+                self.render_on_disk.add(item_id)
+            except Exception as e:
+                print(f"Error saving render data ({item_id}): {e}")
+                failed.add(item_id)
+        return failed
+
+    def flush(self) -> None:
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            render_dirty, self._render_dirty = self._render_dirty, set()
+            render_deleted, self._render_deleted = self._render_deleted, set()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not (dirty or render_dirty or render_deleted):
+            return
+        failed = set()
+        with self._io_lock:
+            if "items" in dirty:
+                # 旧格式（renderData 内嵌在索引里）的图表：随本次写索引一并迁移到 sidecar
+                render_dirty |= {
+                    item_id for item_id, i in list(items_by_id.items())
+                    if "renderData" in i and item_id not in self.render_on_disk
+                }
+            failed_render = self._flush_render_data(render_dirty, render_deleted)
+            if failed_render:
+                # sidecar 没写成功时不能写出去掉 renderData 的索引，否则重启后数据丢失
+                dirty.discard("items")
+                failed.add("items")
+            targets = self._targets()
+            for name in dirty:
+                path, data = targets[name]
+                try:
+                    _write_json_atomic(path, data)
+                except Exception as e:
+                    print(f"Error saving DB ({name}): {e}")
+                    failed.add(name)
+        if failed or failed_render:
+            # 写失败不丢弃脏标记：稍后重试，避免在下一次变更之前内存与文件一直不一致
+            with self._lock:
+                self._dirty.update(failed)
+                self._render_dirty.update(failed_render)
+                if self._batch_depth == 0:
+                    self._schedule_locked(self.retry_interval)
+
+
+def _strip_render_data(item: dict) -> dict:
+    """索引文件中的图表不含 renderData（dict() 是原子的浅拷贝，不受并发修改影响）。"""
+    if "renderData" not in item:
+        return item
+    d = dict(item)
+    d.pop("renderData", None)
+    return d
+
+
+FLUSH_INTERVAL = 0.5  # 秒
+FLUSH_RETRY_INTERVAL = 5.0  # 秒
+db_writer = DBWriter(FLUSH_INTERVAL, FLUSH_RETRY_INTERVAL)
+
+# ETag = 进程启动标识 + 数据版本号：版本号在重启后从 0 开始，带上启动标识避免与重启前的缓存撞车
+_BOOT_ID = uuid.uuid4().hex[:8]
+# no-cache：浏览器每次都带 If-None-Match 回源校验，增删改后立即可见；未变化时 304 几乎无开销
+CACHE_CONTROL = "private, no-cache"
+
+
+def _etag(*parts: Any) -> str:
+    return '"' + "-".join(str(p) for p in (_BOOT_ID, *parts)) + '"'
+
+
+def _conditional_json(request: Request, etag: str, build) -> Response:
+    """If-None-Match 命中当前 ETag 时直接 304，不再构建与序列化响应体。"""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+    return OrjsonResponse(build(), headers=headers)
 
 # Load on startup
-dashboards_db = []
-dashboard_items_db = []
+dashboards_by_id: Dict[str, dict] = {}
+items_by_id: Dict[str, dict] = {}
+# dashboardId -> {itemId: item}（与 items_by_id 共享同一批 dict），GET 时免去全表扫描
+items_by_dashboard: Dict[str, Dict[str, dict]] = defaultdict(dict)
+
+
+def _rebuild_items_index() -> None:
+    items_by_dashboard.clear()
+    for item in items_by_id.values():
+        items_by_dashboard[item["dashboardId"]][item["id"]] = item
+
+
+def _unindex_item(item: dict) -> None:
+    bucket = items_by_dashboard.get(item["dashboardId"])
+    if bucket is None:
+        return
+    bucket.pop(item["id"], None)
+    if not bucket:
+        del items_by_dashboard[item["dashboardId"]]
+
+
 load_db()
 
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"status": "Backend is running"}
 
 
@@ -105,12 +374,23 @@ def get_metadata():
     """获取当前元数据预览，用于调试。"""
     return gemini_engine.get_metadata_preview()
 
+def _validate_query_text(text: str) -> None:
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="查询内容不能为空")
+    if len(text) > gemini_engine.MAX_QUERY_CHARS:
+        raise HTTPException(status_code=400, detail=f"查询内容过长（上限 {gemini_engine.MAX_QUERY_CHARS} 字）")
+
+
 @app.post("/api/query")
 def query_data(request: QueryRequest):
     """
     接收自然语言，返回图表/分析数据。
     若配置了 GENAI_API_KEY，则使用 Gemini 意图路由 + 取数/分析；否则使用规则引擎。
+    问候、帮助之类的输入直接返回 irrelevant，不加载数据也不调用模型。
     """
+    _validate_query_text(request.text)
+    if gemini_engine.is_trivial_query(request.text):
+        return gemini_engine.irrelevant_result()
     if gemini_engine._get_client() is not None:
         history_context = "无历史对话。"
         if request.history:
@@ -136,13 +416,16 @@ def query_data(request: QueryRequest):
         result = data_engine.process_query(request.text)
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
-    return result
+    return OrjsonResponse(result)
 
 @app.post("/api/identify-intent")
 def api_identify_intent(request: QueryRequest):
     """
     仅执行意图识别，用于前端快速反馈。
     """
+    _validate_query_text(request.text)
+    if gemini_engine.is_trivial_query(request.text):
+        return {"intent": "irrelevant"}
     if gemini_engine._get_client() is not None:
         history_context = "无历史对话。"
         if request.history:
@@ -152,78 +435,103 @@ def api_identify_intent(request: QueryRequest):
     return {"intent": "simple"}
 
 @app.get("/api/dashboards")
-def get_dashboards():
-    return dashboards_db
+async def get_dashboards(request: Request):
+    return _conditional_json(
+        request,
+        _etag("dashboards", db_writer.versions["dashboards"]),
+        lambda: list(dashboards_by_id.values()),
+    )
 
 @app.post("/api/dashboards")
 def create_dashboard(name: str, role: str = "总经理"):
-    new_dash = {"id": str(len(dashboards_db) + 1), "name": name, "role": role}
-    dashboards_db.append(new_dash)
-    save_db()
+    new_id = uuid.uuid4().hex[:12]
+    while new_id in dashboards_by_id:
+        new_id = uuid.uuid4().hex[:12]
+    new_dash = {"id": new_id, "name": name, "role": role}
+    dashboards_by_id[new_dash["id"]] = new_dash
+    db_writer.mark_dirty("dashboards")
     return new_dash
 
 @app.delete("/api/dashboards/{dashboard_id}")
 def delete_dashboard(dashboard_id: str):
-    global dashboards_db, dashboard_items_db
-    dashboards_db = [d for d in dashboards_db if d["id"] != dashboard_id]
-    dashboard_items_db = [i for i in dashboard_items_db if i["dashboardId"] != dashboard_id]
-    save_db()
+    with db_writer.batch():
+        dashboards_by_id.pop(dashboard_id, None)
+        removed = list(items_by_dashboard.pop(dashboard_id, {}))
+        for item_id in removed:
+            items_by_id.pop(item_id, None)
+        db_writer.mark_render_deleted(*removed)
+        db_writer.mark_dirty("dashboards", "items")
     return {"status": "deleted"}
 
     raise HTTPException(status_code=404, detail="Dashboard not found")
 
 @app.put("/api/dashboards/{dashboard_id}")
 def update_dashboard(dashboard_id: str, name: Optional[str] = None, role: Optional[str] = None):
-    for d in dashboards_db:
-        if d["id"] == dashboard_id:
-            if name is not None:
-                d["name"] = name
-            if role is not None:
-                d["role"] = role
-            save_db()
-            return d
-    raise HTTPException(status_code=404, detail="Dashboard not found")
+    d = dashboards_by_id.get(dashboard_id)
+    if d is None:
+        raise HTTPException(status_code=404, detail="Dashboard not found")
+    if name is not None:
+        d["name"] = name
+    if role is not None:
+        d["role"] = role
+    db_writer.mark_dirty("dashboards")
+    return d
 
 @app.get("/api/dashboard/{dashboard_id}/items")
-def get_dashboard_items(dashboard_id: str):
-    # 返回属于该看板的图表，并重新计算最新数据
-    items = [item for item in dashboard_items_db if item["dashboardId"] == dashboard_id]
-    
-    # 重新获取实时数据 (Live Data)
-    live_items = []
-    for item in items:
-        # 重新调用引擎获取最新数据 (模拟刷新)
-        # 注意：这里简化了，实际应该存下查询语句重新跑一遍，或者存下 config
-        # 这里假设 config 里存了 dimension/metric，我们简单重跑一次逻辑
-        # 为了演示，我们直接复用存储的 renderData，但在真实 BI 中应该重算
-        live_items.append(item)
-    return live_items
+def get_dashboard_items(dashboard_id: str, request: Request):
+    # 返回属于该看板的图表（按 dashboardId 预建索引，O(1) 查找）
+    # 注意：这里直接复用存储的 renderData，真实 BI 中应存下查询语句重新计算；需要最新数据时走 /refresh
+    # 同步 def：首次访问要读 sidecar 文件，放在线程池里执行，不阻塞事件循环
+    return _conditional_json(
+        request,
+        _etag("items", dashboard_id, db_writer.versions["items"]),
+        # list() 先取快照：其他线程可能同时增删该看板的图表
+        lambda: [_ensure_render_data(i) for i in list(items_by_dashboard.get(dashboard_id, {}).values())],
+    )
 
 @app.post("/api/dashboard/items")
 def add_dashboard_item(item: DashboardItem):
     # 保存到后端
-    item_dict = item.dict()
-    dashboard_items_db.append(item_dict)
-    save_db()
+    item_dict = item.model_dump()
+    old = items_by_id.get(item_dict["id"])
+    if old is not None:  # 相同 id 重复提交：以新内容替换
+        _unindex_item(old)
+    items_by_id[item_dict["id"]] = item_dict
+    items_by_dashboard[item_dict["dashboardId"]][item_dict["id"]] = item_dict
+    with db_writer.batch():
+        db_writer.mark_render_dirty(item_dict["id"])
+        db_writer.mark_dirty("items")
     return {"status": "success", "id": item.id}
 
 @app.delete("/api/dashboard/items/{item_id}")
 def delete_dashboard_item(item_id: str):
-    global dashboard_items_db
-    dashboard_items_db = [i for i in dashboard_items_db if i["id"] != item_id]
-    save_db()
+    item = items_by_id.pop(item_id, None)
+    if item is not None:
+        _unindex_item(item)
+        db_writer.mark_render_deleted(item_id)
+    db_writer.mark_dirty("items")
     return {"status": "deleted"}
 
 
 @app.put("/api/dashboard/items/{item_id}")
 def update_dashboard_item(item_id: str, item: Dict[str, Any]):
     # item 只需要包含要更新的字段，如 title, config 等
-    for i in dashboard_items_db:
-        if i["id"] == item_id:
-            i.update(item)
-            save_db()
-            return i
-    raise HTTPException(status_code=404, detail="Item not found")
+    i = items_by_id.get(item_id)
+    if i is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    item.pop("id", None)  # id 是索引键，不允许通过更新修改
+    if "dashboardId" in item and item["dashboardId"] != i["dashboardId"]:
+        # 图表被移到其他看板：同步迁移索引
+        _unindex_item(i)
+        i.update(item)
+        items_by_dashboard[i["dashboardId"]][item_id] = i
+    else:
+        i.update(item)
+    with db_writer.batch():
+        if "renderData" in item:
+            db_writer.mark_render_dirty(item_id)
+        db_writer.mark_dirty("items")
+    return _ensure_render_data(i)
 
 
 @app.post("/api/dashboard/items/{item_id}/refresh")
@@ -231,20 +539,14 @@ def refresh_dashboard_item(item_id: str):
     """
     刷新看板项目数据：使用存储的 queryText 重新执行查询。
     """
-    # 找到该项目
-    target_item = None
-    for i in dashboard_items_db:
-        if i["id"] == item_id:
-            target_item = i
-            break
-    
+    target_item = items_by_id.get(item_id)
     if not target_item:
         raise HTTPException(status_code=404, detail="Item not found")
     
     query_text = target_item.get("queryText")
     if not query_text:
         raise HTTPException(status_code=400, detail="该项目没有关联的查询语句，无法刷新")
-    
+
     # 重新执行查询
     try:
         if gemini_engine._get_client() is not None:
@@ -258,8 +560,9 @@ def refresh_dashboard_item(item_id: str):
         # 更新 renderData
         new_data = result.get("data") or result.get("fullData") or []
         target_item["renderData"] = new_data
+        db_writer.mark_render_dirty(item_id)
         
-        return {"status": "refreshed", "item": target_item}
+        return OrjsonResponse({"status": "refreshed", "item": target_item})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"刷新失败: {e}")
 
@@ -287,6 +590,10 @@ def suggest_chart(request: ChartSuggestRequest):
     return result
 
 
+# 流式洞察中途失败时的错误标记（ASCII 记录分隔符，正常 Markdown 中不会出现），须与前端 api.js 保持一致
+INSIGHT_ERROR_MARKER = "\x1e"
+
+
 class DashboardInsightRequest(BaseModel):
     items: List[Dict[str, Any]]
 
@@ -296,12 +603,26 @@ def generate_dashboard_insight(req: DashboardInsightRequest):
     """
     根据看板内所有图表数据生成综合洞察。
     items: [{ title, renderData, config }, ...]
+    以 text/plain 流式返回 Markdown，模型每产出一块就推给前端。
+    首块产出前的失败返回非 200；已开始输出后的失败以 INSIGHT_ERROR_MARKER 开头的一段追加在末尾，前端据此报错。
     """
-    return gemini_engine.generate_insight_for_dashboard(req.items)
+    stream = gemini_engine.stream_dashboard_insight(req.items)
+    try:
+        first = next(stream, "")
+    except gemini_engine.InsightUnavailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"洞察生成失败: {e}")
 
+    def body():
+        yield first
+        try:
+            yield from stream
+        except Exception as e:
+            yield f"{INSIGHT_ERROR_MARKER}洞察生成失败: {e}"
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
 
-class ExecutePlanRequest(BaseModel):
-    items: List[Dict[str, Any]]
 
 @app.post("/api/execute-plan")
 def execute_query_plan(request: ExecutePlanRequest):
@@ -309,4 +630,4 @@ def execute_query_plan(request: ExecutePlanRequest):
     执行表格生成计划
     """
     results = gemini_engine.execute_query_plan(request.items)
-    return results
+    return OrjsonResponse(results)
@@ -1,4 +1,3 @@
-import requests
 import json
 
 url = "http://localhost:8000/api/query"
@@ -22,6 +21,8 @@ payload3 = {
 }
 
 def test(name, p):
+    import requests  # 仅手动运行时需要
+
     print(f"--- Testing {name} ---")
     try:
         r = requests.post(url, json=p)
@@ -33,6 +34,7 @@ def test(name, p):
     except Exception as e:
         print(f"Error: {e}")
 
-test("Minimal", payload1)
-test("With Module", payload2)
-test("Bad History", payload3)
+if __name__ == "__main__":
+    test("Minimal", payload1)
+    test("With Module", payload2)
+    test("Bad History", payload3)
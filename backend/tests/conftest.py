@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 让 `pytest` 在任意目录下运行时都能导入 backend/app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
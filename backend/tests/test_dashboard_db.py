@@ -0,0 +1,110 @@
+import time
+from collections import defaultdict
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """把看板持久化指向临时目录，并换一个独立的 DBWriter，不碰 backend/data。"""
+    seed = tmp_path / "seed"
+    seed.mkdir()
+    monkeypatch.setattr(main, "DASHBOARDS_FILE", str(tmp_path / "dashboards.json"))
+    monkeypatch.setattr(main, "ITEMS_FILE", str(tmp_path / "dashboard_items.json"))
+    monkeypatch.setattr(main, "SEED_DIR", str(seed))
+    monkeypatch.setattr(main, "RENDER_DATA_DIR", str(tmp_path / "items"))
+    monkeypatch.setattr(main, "dashboards_by_id", {})
+    monkeypatch.setattr(main, "items_by_id", {})
+    monkeypatch.setattr(main, "items_by_dashboard", defaultdict(dict))
+    writer = main.DBWriter(0.05, 0.1)
+    monkeypatch.setattr(main, "db_writer", writer)
+    yield tmp_path
+    writer.flush()
+
+
+def _wait_for(path, timeout=2.0):
+    deadline = time.time() + timeout
+    while not path.exists() and time.time() < deadline:
+        time.sleep(0.02)
+    return path.exists()
+
+
+def test_read_json_list_falls_back_to_seed_then_default(db):
+    (db / "seed" / "dashboards.json").write_bytes(orjson.dumps([{"id": "s1", "name": "示例"}]))
+    assert main._read_json_list(main.DASHBOARDS_FILE, main.DEFAULT_DASHBOARDS) == [{"id": "s1", "name": "示例"}]
+
+    defaults = main._read_json_list(main.ITEMS_FILE, [{"id": "d"}])
+    assert defaults == [{"id": "d"}]
+    defaults[0]["id"] = "changed"
+    assert main._read_json_list(main.ITEMS_FILE, [{"id": "d"}]) == [{"id": "d"}]
+
+
+def test_render_data_round_trips_through_sidecar(db):
+    main.items_by_id["c1"] = {"id": "c1", "dashboardId": "default", "title": "t", "renderData": [{"name": "A", "value": 1.5}]}
+    main.db_writer.mark_dirty("items")
+    main.db_writer.flush()
+
+    index = orjson.loads((db / "dashboard_items.json").read_bytes())
+    assert index == [{"id": "c1", "dashboardId": "default", "title": "t"}]
+    assert orjson.loads((db / "items" / "c1.json").read_bytes()) == [{"name": "A", "value": 1.5}]
+
+    main.load_db()
+    item = main.items_by_id["c1"]
+    assert "renderData" not in item
+    assert "c1" in main.db_writer.render_on_disk
+    assert main._ensure_render_data(item)["renderData"] == [{"name": "A", "value": 1.5}]
+    assert main.items_by_dashboard["default"]["c1"] is item
+
+
+def test_writer_debounces_and_retries_failed_writes(db, monkeypatch):
+    target = db / "later" / "dashboards.json"
+    monkeypatch.setattr(main, "DASHBOARDS_FILE", str(target))
+    main.dashboards_by_id["default"] = {"id": "default", "name": "默认看板"}
+
+    with main.db_writer.batch():
+        main.db_writer.mark_dirty("dashboards")
+        main.db_writer.mark_dirty("dashboards")
+    assert main.db_writer.versions["dashboards"] == 2
+
+    # 目录不存在：第一次写盘失败，脏标记保留并按 retry_interval 重试
+    time.sleep(0.15)
+    assert not target.exists()
+    target.parent.mkdir()
+    assert _wait_for(target)
+    assert orjson.loads(target.read_bytes()) == [{"id": "default", "name": "默认看板"}]
+    assert not list(target.parent.glob("*.tmp"))
+
+
+def test_dashboard_gets_answer_304_until_a_write(db):
+    client = TestClient(main.app)
+    main.dashboards_by_id["default"] = {"id": "default", "name": "默认看板"}
+
+    first = client.get("/api/dashboards")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == main.CACHE_CONTROL
+
+    cached = client.get("/api/dashboards", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+    client.put("/api/dashboards/default", params={"name": "新名字"})
+    changed = client.get("/api/dashboards", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json() == [{"id": "default", "name": "新名字"}]
+
+
+def test_dashboard_items_etag_changes_after_writer_marks_items(db):
+    client = TestClient(main.app)
+    etag = client.get("/api/dashboard/default/items").headers["etag"]
+    assert client.get("/api/dashboard/default/items", headers={"If-None-Match": etag}).status_code == 304
+
+    main.db_writer.mark_dirty("items")
+    resp = client.get("/api/dashboard/default/items", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["etag"] != etag
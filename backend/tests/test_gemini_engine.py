@@ -0,0 +1,166 @@
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from app import gemini_engine as ge
+
+
+def _run(code, df=None):
+    ctx = ge._new_exec_ctx(df if df is not None else pd.DataFrame({"a": [1]}), {})
+    ge._exec_generated_code(code, ctx)
+    return ctx
+
+
+@pytest.mark.parametrize("code", [
+    "import os",
+    "from os import system",
+    "from pandas.io.common import os as o\no.system('echo hi')",
+    "from pandas.io import common\nresult = common.os",
+    "result = pd.io.common.os",
+    "import pandas.io.common.os",
+    # 经 pickle 反序列化执行命令：先用 to_csv 写出任意文件，再 read_pickle 读回
+    "pd.DataFrame({'x': ['cposix', 'system', \"(S'echo PWNED'\", 'tR.']})"
+    ".to_csv('/tmp/evil.pkl', header=False, index=False, quoting=3, escapechar='\\\\')",
+    "result = pd.read_pickle('/tmp/evil.pkl')",
+    "from pandas import read_pickle",
+    "from pandas import *",
+    "result = np.load('/tmp/x.npy', allow_pickle=True)",
+    "df.apply('to_csv', args=('/tmp/x.csv',))",
+    "result = '{0.__globals__}'.format(pd.read_csv)",
+    "result = '{0}'.format_map({'0': 1})",
+    "result = df.query('@pd.io.common.os.system(\"echo hi\")')",
+])
+def test_generated_code_blocks_dangerous_modules(code):
+    with pytest.raises(ValueError):
+        ge._compile_generated_code(code)
+
+
+def test_pickle_escape_does_not_run(tmp_path):
+    marker = tmp_path / "pwned_marker"
+    pkl = tmp_path / "evil.pkl"
+    code = (
+        f"pd.DataFrame({{'x': ['cposix', 'system', \"(S'touch {marker}'\", 'tR.']}})"
+        f".to_csv({str(pkl)!r}, header=False, index=False, quoting=3, escapechar='\\\\')\n"
+        f"result = pd.read_pickle({str(pkl)!r})\n"
+    )
+    with pytest.raises(ValueError):
+        _run(code)
+    assert not pkl.exists()
+    assert not marker.exists()
+
+
+def test_restricted_import_rejects_blocked_fromlist():
+    with pytest.raises(ImportError):
+        ge._restricted_import("pandas.io.common", fromlist=("os",))
+    with pytest.raises(ImportError):
+        ge._restricted_import("subprocess")
+    with pytest.raises(ImportError):
+        ge._restricted_import("pandas", fromlist=("read_pickle",))
+
+
+def test_generated_code_allows_plain_pandas():
+    ctx = _run("from collections import Counter\nresult = df['a'].sum() + len(Counter('ab'))")
+    assert ctx["result"] == 3
+
+
+def test_text_columns_keep_filtered_groupby_compact():
+    df = pd.DataFrame({
+        "产品": ["A", "B", "C", "A", "B", "C"] * 10,
+        "销售额": range(60),
+    })
+    df = ge._to_arrow_strings(df)
+    assert not isinstance(df["产品"].dtype, pd.CategoricalDtype)
+    sub = df[df["产品"] == "A"]
+    assert sub.groupby("产品")["销售额"].sum().index.tolist() == ["A"]
+    assert sub["产品"].value_counts().index.tolist() == ["A"]
+
+
+def test_generated_code_mutations_stay_local(monkeypatch):
+    cached = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]})
+    monkeypatch.setattr(ge, "_base_exec_ctx", {"pd": pd, "np": ge.np, "df_hcm": cached, "df": cached})
+    _run(
+        "df['c'] = 1\n"
+        "df.loc[0, 'a'] = 99\n"
+        "df.drop(columns=['b'], inplace=True)\n"
+        "df_hcm['a'] = 0\n",
+        df=cached,
+    )
+    assert cached.columns.tolist() == ["a", "b"]
+    assert cached["a"].tolist() == [1, 2, 3]
+
+
+def test_importing_engine_leaves_pandas_options_alone():
+    if ge._EXEC_DEEP_COPY:
+        assert pd.get_option("mode.copy_on_write") is False
+
+
+def _unit(*xs):
+    v = ge.np.asarray(xs, dtype=ge.np.float32)
+    return v / ge.np.linalg.norm(v)
+
+
+def test_semantic_cache_hit_miss_and_scope():
+    cache = ge._SemanticCache(maxsize=4, threshold=0.9)
+    assert cache.get("s", _unit(1, 0)) is None
+    cache.put("s", _unit(1, 0), "single_query")
+    assert cache.get("s", _unit(1, 0.1)) == "single_query"
+    assert cache.get("s", _unit(0, 1)) is None
+    assert cache.get("other", _unit(1, 0)) is None
+
+
+def test_semantic_cache_evicts_least_recently_used():
+    cache = ge._SemanticCache(maxsize=2, threshold=0.99)
+    cache.put("s", _unit(1, 0, 0), "a")
+    cache.put("s", _unit(0, 1, 0), "b")
+    assert cache.get("s", _unit(1, 0, 0)) == "a"
+    cache.put("s", _unit(0, 0, 1), "c")
+    assert cache.get("s", _unit(0, 1, 0)) is None
+    assert cache.get("s", _unit(1, 0, 0)) == "a"
+    assert cache.get("s", _unit(0, 0, 1)) == "c"
+
+
+class _FakeModels:
+    def __init__(self, embed_delay):
+        self.embed_delay = embed_delay
+        self.router_calls = 0
+
+    def embed_content(self, model, contents):
+        time.sleep(self.embed_delay)
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=[1.0, 0.0])])
+
+    def generate_content(self, model, contents, config=None):
+        self.router_calls += 1
+        return SimpleNamespace(text='{"type": "multi_table"}')
+
+
+@pytest.fixture
+def fake_router(monkeypatch):
+    def install(embed_delay):
+        models = _FakeModels(embed_delay)
+        monkeypatch.setattr(ge, "_get_client", lambda: SimpleNamespace(models=models))
+        monkeypatch.setattr(ge, "get_cached_data", lambda: None)
+        monkeypatch.setattr(ge, "_router_cache", ge.OrderedDict())
+        monkeypatch.setattr(ge, "_intent_semantic_cache", ge._SemanticCache(8, 0.9))
+        return models
+    return install
+
+
+def test_identify_intent_does_not_wait_for_slow_embedding(fake_router, monkeypatch):
+    monkeypatch.setattr(ge, "SEMANTIC_EMBED_TIMEOUT", 0.05)
+    models = fake_router(embed_delay=0.5)
+    start = time.monotonic()
+    assert ge.identify_intent("各省份销售额") == "multi_table"
+    assert time.monotonic() - start < 0.4
+    assert models.router_calls == 1
+
+    # 向量算完后补写入语义缓存：换个说法的同一问题不再调用路由
+    deadline = time.monotonic() + 2
+    while ge._intent_semantic_cache.get(
+        ge._llm_cache_key("intent", "", ge._cached_meta_hash), _unit(1, 0)
+    ) is None and time.monotonic() < deadline:
+        time.sleep(0.02)
+    models.embed_delay = 0
+    assert ge.identify_intent("各个省份的销售额") == "multi_table"
+    assert models.router_calls == 1
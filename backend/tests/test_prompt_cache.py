@@ -0,0 +1,68 @@
+import sqlite3
+import time
+
+import pytest
+
+from app import gemini_engine as ge
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """响应缓存指向临时 SQLite 文件；元数据指纹固定，不触发真实的数据加载。"""
+    s = ge._PromptCacheStore(str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(ge, "_prompt_cache_store", s)
+    monkeypatch.setattr(ge, "get_cached_data", lambda: None)
+    monkeypatch.setattr(ge, "_cached_meta_hash", "meta-1")
+    return s
+
+
+def _counting(result_fn):
+    calls = []
+
+    @ge._prompt_cache()
+    def ask(question: str):
+        calls.append(question)
+        return result_fn(question)
+
+    return ask, calls
+
+
+def test_entries_survive_restart_until_ttl(store, tmp_path):
+    store.put("k", {"data": [1, 2]}, ttl=60)
+    store.put("old", {"data": []}, ttl=0.01)
+    time.sleep(0.05)
+    assert store.get("old") is None
+
+    reopened = ge._PromptCacheStore(str(tmp_path / "cache.sqlite"))
+    assert reopened.get("k") == {"data": [1, 2]}
+    # 打开时清理过期条目
+    rows = sqlite3.connect(str(tmp_path / "cache.sqlite")).execute("SELECT key FROM prompt_cache").fetchall()
+    assert rows == [("k",)]
+
+
+def test_decorator_hits_then_invalidates_on_version_and_metadata(store, monkeypatch):
+    ask, calls = _counting(lambda q: {"data": [q]})
+    assert ask("销售额") == {"data": ["销售额"]}
+    assert ask("销售额") == {"data": ["销售额"]}
+    assert calls == ["销售额"]
+
+    monkeypatch.setattr(ge, "PROMPT_CACHE_VERSION", ge.PROMPT_CACHE_VERSION + 1)
+    ask("销售额")
+    assert len(calls) == 2
+
+    monkeypatch.setattr(ge, "_cached_meta_hash", "meta-2")
+    ask("销售额")
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("result", [
+    ge._UncachedResult(data=[], title="兜底"),
+    {"error": "调用失败"},
+    "未配置 GENAI_API_KEY，无法生成洞察。",
+    None,
+])
+def test_failures_and_fallbacks_are_not_stored(store, result):
+    ask, calls = _counting(lambda q: result)
+    ask("问题")
+    ask("问题")
+    assert len(calls) == 2
@@ -0,0 +1,20 @@
+import pandas as pd
+import pytest
+
+from app import engine
+
+
+def test_find_column_prefers_substring_match():
+    df = pd.DataFrame(columns=["省份", "销售额"])
+    assert engine._find_column(df, ["Province", "省份"]) == "省份"
+
+
+@pytest.mark.skipif(engine.fuzz_process is None, reason="rapidfuzz 未安装")
+def test_find_column_fuzzy_hit():
+    df = pd.DataFrame(columns=["Sales Amount", "Region"])
+    assert engine._find_column(df, ["SalesAmount"]) == "Sales Amount"
+
+
+def test_find_column_respects_fuzzy_cutoff():
+    df = pd.DataFrame(columns=["Sales Amount", "Region"])
+    assert engine._find_column(df, ["Manufacturer"]) is None
@@ -436,7 +436,7 @@ export default function ChatBIApp() {
     setIsGeneratingInsight(true);
     setIsInsightCollapsed(false);
     try {
-      const res = await chatApi.generateDashboardInsight(liveDashboardItems);
+      const res = await chatApi.generateDashboardInsight(liveDashboardItems, setDashboardInsight);
       if (res.insight) {
         setDashboardInsight(res.insight);
       }
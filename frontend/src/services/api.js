@@ -1,6 +1,8 @@
 import axios from 'axios';
 
 const API_BASE_URL = 'http://localhost:8000/api';
+// 流式洞察中途失败时后端追加的错误标记（ASCII 记录分隔符），须与 backend/app/main.py 保持一致
+const INSIGHT_ERROR_MARKER = '\x1e';
 
 export const chatApi = {
   queryData: async (text, history = null, module = null, signal = null) => {
@@ -76,9 +78,38 @@ export const chatApi = {
     return response.data;
   },
 
-  generateDashboardInsight: async (items) => {
-    const response = await axios.post(`${API_BASE_URL}/dashboard/insight`, { items });
-    return response.data;
+  // 洞察以 text/plain 流式返回；onChunk(累计文本) 用于边生成边展示
+  generateDashboardInsight: async (items, onChunk) => {
+    const response = await fetch(`${API_BASE_URL}/dashboard/insight`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ items }),
+    });
+    if (!response.ok) {
+      // 开始输出前的失败（未配置 Key、看板为空、模型报错）以非 200 + JSON detail 返回
+      let detail = `Insight request failed: ${response.status}`;
+      try {
+        detail = (await response.json()).detail || detail;
+      } catch (e) { /* 非 JSON 响应，保留状态码信息 */ }
+      throw new Error(detail);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let insight = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      insight += decoder.decode(value, { stream: true });
+      const markerIdx = insight.indexOf(INSIGHT_ERROR_MARKER);
+      if (markerIdx !== -1) {
+        // 输出中途失败：标记之后是错误信息，不当作洞察展示
+        await reader.cancel();
+        throw new Error(insight.slice(markerIdx + 1) || '洞察生成失败');
+      }
+      if (onChunk) onChunk(insight);
+    }
+    insight += decoder.decode();
+    return { insight };
   },
 
   executePlan: async (items) => {
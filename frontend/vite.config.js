@@ -2,7 +2,11 @@ import { defineConfig } from 'vite'
 import react from '@vitejs/plugin-react'
 
 // https://vitejs.dev/config/
-// 不强制指定端口，使用 Vite 默认端口 5173
+// 固定 5173 端口：后端 CORS 只放行 3000/5173，端口被占用时直接报错而不是换端口
 export default defineConfig({
   plugins: [react()],
+  server: {
+    port: 5173,
+    strictPort: true,
+  },
 })